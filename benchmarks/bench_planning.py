@@ -0,0 +1,252 @@
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from domain_template import LogisticDomainTemplate
+from modified_planning import convert_plan
+from native_solver import NativeLogisticSolver
+from plan_cache import cached_to_plan
+
+import unified_planning as up
+from unified_planning.shortcuts import *
+from unified_planning.model.htn import *
+from unified_planning.engines.results import PlanGenerationResult, PlanGenerationResultStatus
+
+# Benchmark of the planning request path on generated logistic instances that
+# are much bigger than the demo map. The Graphene planner is replaced by a
+# local stand-in engine, so the numbers measure our side of the request:
+#   build    -> instantiation of the problem from the domain template
+#   solve    -> engine.solve (stand-in planner + the simulated network latency),
+#               or the in-process NativeLogisticSolver with --native
+#   convert  -> conversion of the returned plan to a SequentialPlan
+#   e2e      -> the sum of the three above
+#
+# Usage: python benchmarks/bench_planning.py [--scale 3,4,5,3,2 ...] [--repeat 20]
+
+
+def generate_map(cities: int, locations_per_city: int) -> Dict[str, Tuple[int, ...]]:
+    # same shape of the demo map: the first location of every city is its airport
+    locations_map = {}
+    for c in range(cities):
+        first_id = c * locations_per_city + 1
+        locations_map[f"city_{first_id}"] = tuple(range(first_id, first_id + locations_per_city))
+    return locations_map
+
+
+def generate_instance(
+    locations_map: Dict[str, Tuple[int, ...]],
+    packages: int,
+    trucks: int,
+    airplanes: int,
+    rng: random.Random,
+) -> Dict[str, Tuple[int, int]]:
+    cities = list(locations_map.values())
+    all_locations = [l for locations in cities for l in locations]
+    airports = [locations[0] for locations in cities]
+    input_values = {}
+    for i in range(1, packages + 1):
+        input_values[f"package_{i}"] = (rng.choice(all_locations), rng.choice(all_locations))
+    for i in range(1, trucks + 1):
+        # trucks are spread over the cities, so every city has one if possible
+        city_locations = cities[(i - 1) % len(cities)]
+        input_values[f"truck_{i}"] = (rng.choice(city_locations), rng.choice(city_locations))
+    for i in range(1, airplanes + 1):
+        input_values[f"airplane_{i}"] = (rng.choice(airports), rng.choice(airports))
+    return input_values
+
+
+class StandInEngine:
+    '''
+    A local replacement of the Graphene planner: it builds a (non optimal) plan
+    greedily, moving every package with the first truck of its city and the
+    first airplane, and waits `latency` seconds to simulate the network.
+    '''
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def solve(self, pb: HierarchicalProblem) -> PlanGenerationResult:
+        time.sleep(self.latency)
+        em = pb.environment.expression_manager
+        city_of: Dict[Object, Object] = {}
+        airport_of: Dict[Object, Object] = {}
+        at: Dict[Object, Object] = {}
+        loc: Dict[Object, Object] = {}
+        for fluent_exp, value in pb.initial_values.items():
+            name, obj = fluent_exp.fluent().name, fluent_exp.arg(0).object()
+            if name == "city":
+                city_of[obj] = value.object()
+                if obj.type.name == "Airport":
+                    airport_of[value.object()] = obj
+            elif name == "at":
+                at[obj] = value.object()
+            elif name == "loc":
+                loc[obj] = value.object()
+        goals = {g.arg(0).arg(0).object(): g.arg(1).object() for g in pb.goals}
+        trucks = [o for o in at if o.type.name == "Truck"]
+        airplanes = [o for o in at if o.type.name == "Airplane"]
+        load, unload, move, fly = (pb.action(n) for n in ("load", "unload", "move", "fly-plane"))
+        actions: List[up.plans.ActionInstance] = []
+
+        def drive(vehicle: Object, target: Object) -> bool:
+            if at[vehicle] == target:
+                return True
+            if vehicle.type.name == "Truck":
+                if city_of[at[vehicle]] != city_of[target]:
+                    return False
+                actions.append(up.plans.ActionInstance(move, (em.ObjectExp(vehicle), em.ObjectExp(at[vehicle]), em.ObjectExp(target))))
+            else:
+                actions.append(up.plans.ActionInstance(fly, (em.ObjectExp(vehicle), em.ObjectExp(at[vehicle]), em.ObjectExp(target))))
+            at[vehicle] = target
+            return True
+
+        def carry(package: Object, vehicle: Object, src: Object, tgt: Object) -> bool:
+            if src == tgt:
+                return True
+            if not drive(vehicle, src):
+                return False
+            actions.append(up.plans.ActionInstance(load, (em.ObjectExp(package), em.ObjectExp(vehicle), em.ObjectExp(src))))
+            if not drive(vehicle, tgt):
+                return False
+            actions.append(up.plans.ActionInstance(unload, (em.ObjectExp(package), em.ObjectExp(vehicle), em.ObjectExp(tgt))))
+            return True
+
+        def truck_in(city: Object) -> Optional[Object]:
+            return next((t for t in trucks if city_of[at[t]] == city), None)
+
+        unsolvable = PlanGenerationResult(PlanGenerationResultStatus.UNSOLVABLE_INCOMPLETELY, None, "stand-in")
+        for package, start in loc.items():
+            dest = goals[package]
+            if start == dest:
+                continue
+            src_city, dest_city = city_of[start], city_of[dest]
+            if src_city == dest_city:
+                truck = truck_in(src_city)
+                if truck is None or not carry(package, truck, start, dest):
+                    return unsolvable
+                continue
+            src_airport, dest_airport = airport_of[src_city], airport_of[dest_city]
+            if start != src_airport:
+                truck = truck_in(src_city)
+                if truck is None or not carry(package, truck, start, src_airport):
+                    return unsolvable
+            if not airplanes or not carry(package, airplanes[0], src_airport, dest_airport):
+                return unsolvable
+            if dest != dest_airport:
+                truck = truck_in(dest_city)
+                if truck is None or not carry(package, truck, dest_airport, dest):
+                    return unsolvable
+        for vehicle in trucks + airplanes:
+            if not drive(vehicle, goals[vehicle]):
+                return unsolvable
+        return PlanGenerationResult(PlanGenerationResultStatus.SOLVED_SATISFICING, up.plans.SequentialPlan(actions), "stand-in")
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def run_scale(
+    cities: int,
+    locations_per_city: int,
+    packages: int,
+    trucks: int,
+    airplanes: int,
+    repeat: int,
+    engine: StandInEngine,
+    memory: bool,
+    seed: int,
+    native: bool = False,
+) -> Dict[str, float]:
+    rng = random.Random(seed)
+    locations_map = generate_map(cities, locations_per_city)
+    start = time.perf_counter()
+    domain_template = LogisticDomainTemplate(locations_map)
+    template_time = time.perf_counter() - start
+    native_solver = NativeLogisticSolver(locations_map) if native else None
+
+    build_times, solve_times, convert_times, e2e_times, peaks = [], [], [], [], []
+    solved = 0
+    for _ in range(repeat):
+        input_values = generate_instance(locations_map, packages, trucks, airplanes, rng)
+        gc.collect()
+        if memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        pb = domain_template.instantiate(input_values)
+        t1 = time.perf_counter()
+        if native_solver is not None:
+            native_plan = native_solver.solve(input_values)
+            t2 = time.perf_counter()
+            plan = cached_to_plan(native_plan, pb)
+        else:
+            res = engine.solve(pb)
+            t2 = time.perf_counter()
+            plan = convert_plan(res.plan, pb)
+        t3 = time.perf_counter()
+        if memory:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        solved += plan is not None
+        build_times.append(t1 - t0)
+        solve_times.append(t2 - t1)
+        convert_times.append(t3 - t2)
+        e2e_times.append(t3 - t0)
+    return {
+        "template": template_time,
+        "build": statistics.mean(build_times),
+        "solve": statistics.mean(solve_times),
+        "convert": statistics.mean(convert_times),
+        "p50": percentile(e2e_times, 50),
+        "p95": percentile(e2e_times, 95),
+        "p99": percentile(e2e_times, 99),
+        "throughput": repeat / sum(e2e_times),
+        "peak_kb": max(peaks) / 1024 if peaks else float("nan"),
+        "solved": solved / repeat,
+    }
+
+
+DEFAULT_SCALES = [
+    # cities, locations per city, packages, trucks, airplanes
+    (3, 4, 5, 3, 2),
+    (5, 5, 20, 5, 2),
+    (10, 10, 50, 10, 4),
+    (20, 20, 200, 20, 8),
+]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Latency/throughput benchmark of the planning request path.")
+    parser.add_argument("--scale", action="append", default=None,
+                        help="cities,locations_per_city,packages,trucks,airplanes (can be repeated)")
+    parser.add_argument("--repeat", type=int, default=20, help="instances solved per scale")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated planner latency in seconds")
+    parser.add_argument("--native", action="store_true", help="solve with the in-process native solver")
+    parser.add_argument("--no-memory", action="store_true", help="don't trace the memory peaks (faster)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    get_environment().credits_stream = None
+    scales = DEFAULT_SCALES if args.scale is None else [tuple(map(int, s.split(","))) for s in args.scale]
+    engine = StandInEngine(args.latency)
+
+    columns = ["template", "build", "solve", "convert", "p50", "p95", "p99"]
+    header = f"{'scale':<20}" + "".join(f"{c + ' ms':>12}" for c in columns) + f"{'req/s':>10}{'peak KB':>10}{'solved':>8}"
+    print(header)
+    for scale in scales:
+        r = run_scale(*scale, repeat=args.repeat, engine=engine, memory=not args.no_memory, seed=args.seed, native=args.native)
+        row = f"{','.join(map(str, scale)):<20}" + "".join(f"{r[c] * 1000:>12.2f}" for c in columns)
+        print(row + f"{r['throughput']:>10.1f}{r['peak_kb']:>10.0f}{r['solved']:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import json
+import logging
+import queue
+import sys
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, Optional, Tuple, Union
+
+from input_validation import check_assignment
+from plan_cache import PlanCache, plan_to_cached
+from scheduler import PlanningJob, PlanningScheduler
+from native_solver import NativeLogisticSolver
+from decomposition import ProblemDecomposer
+from engine_client import AsyncEngineClient, ClientEngine, LoopService
+from portfolio import Portfolio, flat_portfolio_members
+
+# Headless solving of logistic instances, without the justpy gui.
+#
+# The input is a JSON Lines file, every line is an instance mapping the object
+# names to their [start, destination] location ids, for example:
+#   {"package_1": [1, 4], "truck_1": [1, 1], "truck_2": [4, 4], "airplane_1": [1, 1]}
+# The output is a JSON Lines stream with one result per instance, in the order
+# the instances are solved:
+#   {"index": 0, "status": "solved", "plan": [["load", ["package_1", "truck_1", "airport_1"]], ...], "time": 0.12}
+# The instances with wrong fields (see input_validation.py) are not solved:
+#   {"index": 1, "status": "invalid", "errors": [{"object": "truck_1", "field": "destination", "error": ...}]}
+# and neither are the lines that are not an instance, with their line number:
+#   {"index": 2, "status": "invalid", "line": 3, "errors": [{"error": "Expecting value: line 1 column 1 (char 0)"}]}
+# With --decomposition, the solved instances also have the task decomposition
+# of the hierarchical plans, as nested [task id, method or action, parameters,
+# subtasks] lists.
+
+
+class MalformedLine:
+    __slots__ = ("line_number", "error")
+
+    def __init__(self, line_number: int, error: str):
+        self.line_number = line_number
+        self.error = error
+
+
+def read_instances(lines: Iterable[str]) -> Iterator[Union[Dict[str, Tuple[Any, Any]], MalformedLine]]:
+    # the values are checked by solve_batch; a wrong line doesn't stop the others
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            instance = json.loads(line)
+            if not isinstance(instance, dict):
+                raise ValueError("the instance is not a json object")
+            values = {}
+            for name, pair in instance.items():
+                if not isinstance(pair, list) or len(pair) != 2:
+                    raise ValueError(f"{name} is not a [start, destination] pair")
+                values[name] = (pair[0], pair[1])
+        except ValueError as e:
+            yield MalformedLine(line_number, str(e))
+            continue
+        yield values
+
+
+def job_result(index: int, job: PlanningJob) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"index": index}
+    if job.error is not None:
+        result["status"] = "error"
+        result["error"] = str(job.error) or type(job.error).__name__
+    elif job.plan is None:
+        result["status"] = "no_plan"
+        if job.infeasible is not None:
+            result["reason"] = job.infeasible.message
+    else:
+        result["status"] = "solved"
+        result["plan"] = plan_to_cached(job.plan)
+        if job.decomposition is not None:
+            result["decomposition"] = job.decomposition
+    assert job.started_at is not None and job.finished_at is not None
+    result["time"] = job.finished_at - job.started_at
+    return result
+
+
+def solve_batch(
+    instances: Iterable[Union[Dict[str, Tuple[Any, Any]], MalformedLine]],
+    engine_factory: Callable[[], Any],
+    workers: int = 1,
+    plan_cache: Optional[PlanCache] = None,
+    native_solver: Optional[NativeLogisticSolver] = None,
+    decomposer: Optional[ProblemDecomposer] = None,
+    engine_client: Optional[LoopService] = None,
+    timeout: Optional[float] = None,
+    optimize_plans: bool = False,
+    decompositions: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    '''
+    Solves the given instances with `workers` parallel engines, yielding the
+    results as soon as they are available (so not necessarily in input order,
+    every result has the index of its instance). With an `engine_client`,
+    its engines are used instead of `engine_factory` and every instance is
+    given up after `timeout` seconds.
+    '''
+    scheduler = PlanningScheduler(
+        engine_factory, workers, max_queue_depth=2 * workers,
+        plan_cache=plan_cache, native_solver=native_solver, decomposer=decomposer,
+        engine_client=engine_client, request_timeout=timeout, optimize_plans=optimize_plans,
+        decompositions=decompositions,
+    )
+    scheduler.start()
+    done: "queue.Queue[PlanningJob]" = queue.Queue()
+    submitted = 0
+    try:
+        for index, instance in enumerate(instances):
+            if isinstance(instance, MalformedLine):
+                yield {"index": index, "status": "invalid", "line": instance.line_number, "errors": [{"error": instance.error}], "time": 0.0}
+                continue
+            check = check_assignment(instance)
+            if not check:
+                yield {"index": index, "status": "invalid", "errors": [e.to_json() for e in check.errors], "time": 0.0}
+                continue
+            # blocks when all workers are busy, so the input is read lazily
+            scheduler.submit(check.input_values, index, done.put, block=True)
+            submitted += 1
+            while not done.empty():
+                job = done.get()
+                submitted -= 1
+                yield job_result(job.session, job)
+        while submitted > 0:
+            job = done.get()
+            submitted -= 1
+            yield job_result(job.session, job)
+    finally:
+        scheduler.stop()
+
+
+def engine_factory_from_name(planner: str, port: int) -> Callable[[], Any]:
+    if planner == "graphene":
+        from up_graphene_engine.engine import GrapheneEngine
+        return lambda: GrapheneEngine(port=port)
+    from unified_planning.shortcuts import OneshotPlanner
+    return lambda: OneshotPlanner(name=planner)
+
+
+def run_batch(
+    input_file: IO[str],
+    output_file: IO[str],
+    engine_factory: Callable[[], Any],
+    workers: int = 1,
+    plan_cache: Optional[PlanCache] = None,
+    native_solver: Optional[NativeLogisticSolver] = None,
+    decomposer: Optional[ProblemDecomposer] = None,
+    engine_client: Optional[LoopService] = None,
+    timeout: Optional[float] = None,
+    optimize_plans: bool = False,
+    decompositions: bool = False,
+) -> Dict[str, int]:
+    counters = {"solved": 0, "no_plan": 0, "invalid": 0, "error": 0}
+    results = solve_batch(
+        read_instances(input_file), engine_factory, workers, plan_cache, native_solver, decomposer, engine_client, timeout,
+        optimize_plans, decompositions,
+    )
+    for result in results:
+        counters[result["status"]] += 1
+        output_file.write(json.dumps(result) + "\n")
+        output_file.flush()
+    return counters
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Solve a JSON Lines file of logistic instances without the gui.")
+    parser.add_argument("instances", help="JSON Lines file with one instance per line, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSON Lines output file, '-' for stdout")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of instances solved in parallel")
+    parser.add_argument("--planner", default="graphene", help="'graphene' or the name of a unified-planning engine")
+    parser.add_argument("--port", type=int, default=8061, help="port of the graphene planner")
+    parser.add_argument("--native", action="store_true", help="solve in-process when possible, the planner is the fallback")
+    parser.add_argument("--optimize", action="store_true", help="shorten the plans with the local optimizer")
+    parser.add_argument("--decomposition", action="store_true",
+                        help="write the task decomposition of the hierarchical plans with the plans")
+    parser.add_argument("--decompose", type=int, default=0, metavar="N",
+                        help="split the big instances into independent groups solved by N more engines")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds after which an instance is given up")
+    parser.add_argument("--retries", type=int, default=0, help="attempts again the failed and timed out planner calls")
+    parser.add_argument("--portfolio", default=None, metavar="PLANNERS",
+                        help="comma separated unified-planning planners racing --planner on the flat encoding")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="with --portfolio, seconds given to the planners to find a shorter plan than the first one")
+    parser.add_argument("--cache-dir", default=None, help="directory of the persistent plan cache")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(format='%(asctime)s %(message)s', stream=sys.stderr)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    plan_cache = PlanCache(persistent_dir=args.cache_dir) if args.cache_dir is not None else None
+    engine_factory = engine_factory_from_name(args.planner, args.port)
+    engine_client = None
+    if args.timeout is not None or args.retries > 0 or args.portfolio:
+        engine_client = AsyncEngineClient(engine_factory, args.workers + args.decompose, args.timeout, args.retries)
+        if args.portfolio:
+            members = [(args.planner, engine_client)] + flat_portfolio_members(
+                args.portfolio.split(","), args.workers + args.decompose, args.timeout, args.retries,
+            )
+            engine_client = Portfolio(members, args.budget)
+        engine_client.start()
+        engine_factory = lambda: ClientEngine(engine_client)
+
+    input_file = sys.stdin if args.instances == "-" else open(args.instances)
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w")
+    decomposer = None
+    try:
+        native_solver = NativeLogisticSolver() if args.native else None
+        if args.decompose > 0:
+            decomposer = ProblemDecomposer(
+                engine_factory, args.decompose, plan_cache=plan_cache, native_solver=native_solver,
+                optimize_plans=args.optimize, engine_client=engine_client,
+            )
+            decomposer.start()
+        counters = run_batch(
+            input_file, output_file, engine_factory, args.workers, plan_cache, native_solver, decomposer,
+            engine_client, args.timeout, args.optimize, args.decomposition,
+        )
+    finally:
+        if decomposer is not None:
+            decomposer.stop()
+        if engine_client is not None:
+            engine_client.stop()
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    print(", ".join(f"{k}: {v}" for k, v in counters.items()), file=sys.stderr)
+    return 0 if counters["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+from typing import Dict, List, Tuple
+
+from logistic_map import LOCATIONS_MAP
+from topology import get_topology
+
+# Two logistic instances that only differ by a renaming of interchangeable
+# objects have the same plans, up to the same renaming. Interchangeable are:
+#  - packages, trucks and airplanes of the same kind (they are just names)
+#  - the non-airport locations of the same city (they are all connected with
+#    each other and with the airport of the city in the same way)
+# The canonical form renames the objects of each kind as kind_1, ..., kind_n
+# sorted by their (start, destination) and the locations of each city sorted by
+# how they are used, so that symmetric instances share the same canonical form.
+
+
+def location_name(location_id: int, locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP) -> str:
+    return get_topology(locations_map).location_name(location_id)
+
+
+def _locations_renaming(input_values: Dict[str, Tuple[int, int]], locations_map: Dict[str, Tuple[int, ...]]) -> Dict[int, int]:
+    usage: Dict[int, List[Tuple[str, int]]] = {}
+    for object_name, (start, dest) in input_values.items():
+        kind = object_name.split("_")[0]
+        usage.setdefault(start, []).append((kind, 0))
+        usage.setdefault(dest, []).append((kind, 1))
+
+    locations_renaming: Dict[int, int] = {}
+    for locations in locations_map.values():
+        if not locations:
+            continue
+        # the airport is never renamed
+        locations_renaming[locations[0]] = locations[0]
+        others = sorted(locations[1:])
+        # ties are broken by id; that's always correct, only less canonical
+        by_usage = sorted(others, key=lambda l: (sorted(usage.get(l, [])), l))
+        for old_id, new_id in zip(by_usage, others):
+            locations_renaming[old_id] = new_id
+    return locations_renaming
+
+
+def canonicalize(
+    input_values: Dict[str, Tuple[int, int]],
+    locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP,
+) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, str]]:
+    '''
+    Returns the canonical form of the given input values and the renaming from
+    the names of the given instance to the canonical names (both for the
+    packages/vehicles and for the location objects).
+    '''
+    locations_renaming = _locations_renaming(input_values, locations_map)
+    renaming: Dict[str, str] = {
+        location_name(old_id, locations_map): location_name(new_id, locations_map)
+        for old_id, new_id in locations_renaming.items()
+    }
+    by_kind: Dict[str, List[Tuple[Tuple[int, int], str]]] = {}
+    for object_name, (start, dest) in input_values.items():
+        kind = object_name.split("_")[0]
+        start_dest = (
+            locations_renaming.get(start, start),
+            locations_renaming.get(dest, dest),
+        )
+        by_kind.setdefault(kind, []).append((start_dest, object_name))
+
+    canonical_values: Dict[str, Tuple[int, int]] = {}
+    for kind in sorted(by_kind):
+        for i, (start_dest, object_name) in enumerate(sorted(by_kind[kind]), 1):
+            canonical_name = f"{kind}_{i}"
+            canonical_values[canonical_name] = start_dest
+            renaming[object_name] = canonical_name
+    return canonical_values, renaming
+
+
+def invert_renaming(renaming: Dict[str, str]) -> Dict[str, str]:
+    return {new_name: old_name for old_name, new_name in renaming.items()}
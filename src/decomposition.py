@@ -0,0 +1,197 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logistic_map import LOCATIONS_MAP
+from plan_cache import PlanCache, cached_to_plan, plan_to_cached
+from metrics import RequestTrace
+from native_solver import NativeLogisticSolver
+from scheduler import PlanningJob, PlanningScheduler
+from engine_client import ClientEngine, LoopService, SolveCancelled
+from topology import get_topology
+from validation import validate_cached
+
+import unified_planning as up
+from unified_planning.shortcuts import *
+from unified_planning.model.htn import *
+
+# Decomposition of an instance into independent groups of objects.
+#
+# Trucks never leave their city, so two packages are coupled only when they
+# need the trucks of the same city, or the same airplane. The cities are joined
+# by the packages travelling between them, and every group of joined cities
+# that needs an airplane gets its own share of the airplanes (groups are merged
+# when there are fewer airplanes than groups). Groups share no package and no
+# vehicle, so their plans can be solved separately and simply concatenated.
+
+
+class _Groups:
+    # union-find over the city indexes
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        self.parent[self.find(i)] = self.find(j)
+
+
+class ProblemDecomposer:
+    '''
+    Splits the big instances into independent groups (see above), solves the
+    groups concurrently with a pool of `workers` engines and merges their plans
+    into a plan of the whole problem, checked by the plan validator.
+
+    solve() returns None when the instance is not worth splitting, or when a
+    group has no plan or the merged plan is not valid: the caller then solves
+    the whole problem, which gives the definitive answer. With an
+    `engine_client`, the groups are bounded by the deadline of the request
+    and cancelled with it.
+    '''
+    def __init__(
+        self,
+        engine_factory,
+        workers: int = 2,
+        locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP,
+        min_packages: int = 8,
+        plan_cache: Optional[PlanCache] = None,
+        native_solver: Optional[NativeLogisticSolver] = None,
+        validate: bool = True,
+        optimize_plans: bool = False,
+        engine_client: Optional[LoopService] = None,
+    ):
+        self.topology = get_topology(locations_map)
+        self.min_packages = min_packages
+        self.validate = validate
+        # the groups are solved by a pool of their own, a job of the main
+        # scheduler waiting for its groups can't take the workers they need
+        self.scheduler = PlanningScheduler(
+            engine_factory, workers, max_queue_depth=2 * workers,
+            plan_cache=plan_cache, native_solver=native_solver, optimize_plans=optimize_plans,
+            engine_client=engine_client,
+        )
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def partition(self, input_values: Dict[str, Tuple[int, int]]) -> List[Dict[str, Tuple[int, int]]]:
+        topology = self.topology
+        names = list(input_values)
+        kinds = [name.split("_")[0] for name in names]
+        starts = np.array([input_values[n][0] for n in names], dtype=np.int64)
+        dests = np.array([input_values[n][1] for n in names], dtype=np.int64)
+        if not (topology.valid(starts).all() and topology.valid(dests).all()):
+            # left to the planner, which reports the error
+            return [input_values]
+        start_cities = topology.cities(starts).tolist()
+        dest_cities = topology.cities(dests).tolist()
+
+        groups = _Groups(len(topology.city_names))
+        airplanes = [i for i, kind in enumerate(kinds) if kind == "airplane"]
+        travelling = [i for i, kind in enumerate(kinds) if kind == "package" and start_cities[i] != dest_cities[i]]
+        for i in travelling:
+            groups.union(start_cities[i], dest_cities[i])
+        needing_airplane = sorted({groups.find(start_cities[i]) for i in travelling})
+        if needing_airplane and not airplanes:
+            return [input_values]
+        # with fewer airplanes than groups, the groups share them round robin
+        for j in range(len(airplanes), len(needing_airplane)):
+            groups.union(needing_airplane[j], needing_airplane[j % len(airplanes)])
+        needing_airplane = sorted({groups.find(r) for r in needing_airplane})
+
+        group_of: List[Optional[int]] = [None] * len(names)
+        for i, kind in enumerate(kinds):
+            if kind in ("package", "truck"):
+                group_of[i] = groups.find(start_cities[i])
+        for n, i in enumerate(airplanes):
+            if needing_airplane:
+                group_of[i] = needing_airplane[n % len(needing_airplane)]
+
+        package_groups = {group_of[i] for i, kind in enumerate(kinds) if kind == "package"}
+        if len(package_groups) <= 1:
+            return [input_values]
+        sizes: Dict[int, int] = {}
+        for g in group_of:
+            if g in package_groups:
+                sizes[g] = sizes.get(g, 0) + 1
+        # the vehicles of the groups without packages only have to be brought
+        # to their destination, they join the smallest group
+        smallest = min(sizes, key=sizes.get)
+        result: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        for name, g in zip(names, group_of):
+            if g not in package_groups:
+                g = smallest
+            result.setdefault(g, {})[name] = input_values[name]
+        return list(result.values())
+
+    def solve(
+        self,
+        input_values: Dict[str, Tuple[int, int]],
+        pb: HierarchicalProblem,
+        trace: Optional[RequestTrace] = None,
+        engine: Optional[ClientEngine] = None,
+    ) -> Optional[up.plans.SequentialPlan]:
+        # `engine` is the one of the request, its deadline and cancellation
+        # apply to the groups
+        packages = sum(1 for name in input_values if name.startswith("package_"))
+        if packages < self.min_packages:
+            return None
+        if trace is None:
+            trace = RequestTrace()
+
+        with trace.stage("decompose"):
+            parts = self.partition(input_values)
+        if len(parts) <= 1:
+            return None
+        self.logger.info(f"Solving {len(parts)} independent groups...")
+
+        jobs: List[PlanningJob] = []
+
+        def cancel_jobs():
+            for job in list(jobs):
+                job.cancel()
+
+        client_engine = engine if isinstance(engine, ClientEngine) else None
+        deadline = client_engine.deadline if client_engine is not None else None
+        if client_engine is not None:
+            client_engine.add_cancel_callback(cancel_jobs)
+        try:
+            with trace.stage("solve_groups"):
+                for part in parts:
+                    jobs.append(self.scheduler.submit(part, block=True, parent_trace=trace, deadline=deadline))
+                    if client_engine is not None and client_engine.cancelled:
+                        cancel_jobs()
+                for job in jobs:
+                    job.wait()
+        finally:
+            if client_engine is not None:
+                client_engine.remove_cancel_callback(cancel_jobs)
+        if client_engine is not None and client_engine.cancelled:
+            raise SolveCancelled("Solve cancelled")
+        for job in jobs:
+            if job.error is not None or job.plan is None:
+                self.logger.info(f"Group of job {job.job_id} not solved, solving the whole problem")
+                return None
+
+        with trace.stage("merge"):
+            # the groups share no object, any interleaving of their plans is valid
+            merged = []
+            for job in jobs:
+                merged.extend(plan_to_cached(job.plan))
+
+        if self.validate:
+            with trace.stage("validate"):
+                valid = validate_cached(input_values, merged)
+            if not valid:
+                self.logger.warning(f"Merged plan is not valid ({valid.error}), solving the whole problem")
+                return None
+        return cached_to_plan(merged, pb)
@@ -0,0 +1,320 @@
+import abc
+import asyncio
+import concurrent.futures
+import logging
+import time
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+
+from metrics import METRICS
+
+if TYPE_CHECKING:
+    from unified_planning.model.htn import HierarchicalProblem
+    from unified_planning.engines.results import PlanGenerationResult
+
+ENGINE_TIMEOUTS = METRICS.counter("planning_engine_timeouts_total", "Engine solves abandoned after their timeout.")
+ENGINE_RETRIES = METRICS.counter("planning_engine_retries_total", "Engine solves attempted again after a failure.")
+ENGINE_CANCELLED = METRICS.counter("planning_engine_cancelled_total", "Engine solves cancelled by the requester.")
+ENGINE_ABANDONED = METRICS.gauge("planning_engine_abandoned_solves", "Solves timed out or cancelled whose engine has not returned yet.")
+
+
+class EngineTimeout(Exception):
+    '''Raised when the engine doesn't answer before the timeout or the deadline of the request.'''
+    pass
+
+
+class SolveCancelled(Exception):
+    '''Raised by ClientEngine.solve when the request has been cancelled.'''
+    pass
+
+
+def _call_soon(loop: asyncio.AbstractEventLoop, callback: Callable[..., Any], *args):
+    # from the threads of the solves, which may end after the client is stopped
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    # the future is cancelled when the solve is abandoned
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
+
+
+class LoopService(abc.ABC):
+    '''
+    Base of the services whose `async solve(pb, timeout, deadline)` runs on an
+    event loop of their own, in a daemon thread; submit() can be called from
+    any thread.
+    '''
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[Thread] = None
+
+    def _on_loop_start(self):
+        # called in the loop thread, before serving any solve
+        pass
+
+    def start(self):
+        started = Event()
+
+        def run_loop():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._on_loop_start()
+            started.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = Thread(target=run_loop, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    @abc.abstractmethod
+    async def solve(
+        self,
+        pb: "HierarchicalProblem",
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+    ) -> "PlanGenerationResult":
+        pass
+
+    def submit(
+        self,
+        pb: "HierarchicalProblem",
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+    ) -> concurrent.futures.Future:
+        # cancelling the returned future cancels the solve
+        assert self._loop is not None, f"{type(self).__name__} not started"
+        return asyncio.run_coroutine_threadsafe(self.solve(pb, timeout, deadline), self._loop)
+
+
+class AsyncEngineClient(LoopService):
+    '''
+    asyncio front-end of the blocking engines (e.g. GrapheneEngine): every
+    solve runs on its own daemon thread and is awaited on the event loop of
+    the client, so many solves are multiplexed on one loop, at most
+    `max_concurrent` at a time.
+
+    A solve taking longer than `timeout` seconds (or past the deadline given
+    to solve) is abandoned: its engine is destroyed, to close its connection
+    to the planner, and never used again. Its thread keeps its place among
+    the `max_concurrent` ones until the engine returns, so the solves still
+    running on the planner are bounded too. Failed and timed out solves are
+    attempted again up to `retries` times, waiting `retry_backoff` seconds,
+    doubled at every attempt. Cancelling the solve task (or the future
+    returned by submit) abandons the solve in the same way.
+    '''
+    def __init__(
+        self,
+        engine_factory: Callable[[], Any],
+        max_concurrent: int = 4,
+        timeout: Optional[float] = None,
+        retries: int = 1,
+        retry_backoff: float = 0.5,
+    ):
+        super().__init__()
+        assert max_concurrent > 0 and retries >= 0
+        self.engine_factory = engine_factory
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        # idle engines, created on demand
+        self._engines: List[Any] = []
+        self._engines_lock = Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.logger = logging.getLogger(__name__)
+
+    def _on_loop_start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    def _take_engine(self) -> Any:
+        with self._engines_lock:
+            if self._engines:
+                return self._engines.pop()
+        return self.engine_factory()
+
+    def _give_back_engine(self, engine: Any):
+        with self._engines_lock:
+            self._engines.append(engine)
+
+    def _destroy_engine(self, engine: Any):
+        # e.g. closes the channel of the engine, which ends the call in progress
+        def run():
+            try:
+                destroy = getattr(engine, "destroy", None) or getattr(engine, "close", None)
+                if destroy is not None:
+                    destroy()
+            except Exception as e:
+                self.logger.warning(f"Destroying an abandoned engine failed: {e}")
+
+        Thread(target=run, name="engine-destroy", daemon=True).start()
+
+    async def _attempt(self, pb: "HierarchicalProblem", timeout: Optional[float], deadline: Optional[float]) -> "PlanGenerationResult":
+        # the permit is given back by the thread of the solve when it ends,
+        # even when the solve has been abandoned
+        if deadline is None:
+            await self._semaphore.acquire()
+        else:
+            await asyncio.wait_for(self._semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # the engine of the attempt once created, whether the thread has
+        # ended and whether the attempt has been abandoned
+        state = {"engine": None, "finished": False, "abandoned": False}
+        state_lock = Lock()
+
+        def run():
+            try:
+                engine = self._take_engine()
+                with state_lock:
+                    state["engine"] = engine
+                    abandoned = state["abandoned"]
+                if abandoned:
+                    self._destroy_engine(engine)
+                    return
+                result = engine.solve(pb)
+            except BaseException as e:
+                _call_soon(loop, _set_exception, future, e)
+            else:
+                _call_soon(loop, _set_result, future, result)
+            finally:
+                with state_lock:
+                    state["finished"] = True
+                    if state["abandoned"]:
+                        ENGINE_ABANDONED.inc(amount=-1)
+                _call_soon(loop, self._semaphore.release)
+
+        Thread(target=run, name="engine-solve", daemon=True).start()
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # the engine may still be solving: it's destroyed and dropped
+            # (CancelledError, when the solve is cancelled, is not an Exception)
+            with state_lock:
+                engine = state["engine"]
+                if not state["finished"]:
+                    state["abandoned"] = True
+                    ENGINE_ABANDONED.inc()
+            if engine is not None:
+                self._destroy_engine(engine)
+            raise
+        except Exception:
+            if state["engine"] is not None:
+                self._give_back_engine(state["engine"])
+            raise
+        self._give_back_engine(state["engine"])
+        return result
+
+    async def solve(
+        self,
+        pb: "HierarchicalProblem",
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+    ) -> "PlanGenerationResult":
+        '''
+        Solves the problem with one of the engines. `timeout` (default: the
+        timeout of the client) bounds every attempt, `deadline` (a
+        time.monotonic() value) bounds the whole solve, retries and the wait
+        for a free engine included.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        if deadline is not None:
+            budget = deadline - time.monotonic()
+        attempt = 0
+        while True:
+            by_deadline = False
+            attempt_timeout = timeout
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise EngineTimeout(f"No answer from the engine within the deadline of the request ({budget:.2f}s)")
+                if attempt_timeout is None or left < attempt_timeout:
+                    attempt_timeout, by_deadline = left, True
+            try:
+                return await self._attempt(pb, attempt_timeout, deadline)
+            except asyncio.CancelledError:
+                ENGINE_CANCELLED.inc()
+                raise
+            except asyncio.TimeoutError:
+                ENGINE_TIMEOUTS.inc()
+                if by_deadline or (deadline is not None and time.monotonic() >= deadline):
+                    raise EngineTimeout(f"No answer from the engine within the deadline of the request ({budget:.2f}s)")
+                error: Exception = EngineTimeout(f"No answer from the engine in {timeout:.2f}s")
+            except Exception as e:
+                error = e
+            if attempt >= self.retries:
+                raise error
+            self.logger.warning(f"Engine solve failed ({error}), trying again...")
+            ENGINE_RETRIES.inc()
+            backoff = self.retry_backoff * 2 ** attempt
+            if deadline is not None:
+                backoff = min(backoff, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+
+class ClientEngine:
+    '''
+    Blocking engine backed by an AsyncEngineClient (or any LoopService), for
+    the code written against engine.solve(pb) (e.g. planning). cancel() can be
+    called from any thread, the solve in progress and the next ones raise
+    SolveCancelled, and the cancel callbacks are called (e.g. to cancel the
+    jobs solving parts of the problem elsewhere).
+    '''
+    def __init__(self, client: LoopService, timeout: Optional[float] = None, deadline: Optional[float] = None):
+        self.client = client
+        self.timeout = timeout
+        self.deadline = deadline
+        self.cancelled = False
+        self._future: Optional[concurrent.futures.Future] = None
+        self._cancel_callbacks: List[Callable[[], None]] = []
+        self._lock = Lock()
+
+    def solve(self, pb: "HierarchicalProblem") -> "PlanGenerationResult":
+        with self._lock:
+            if self.cancelled:
+                raise SolveCancelled("Solve cancelled")
+            self._future = future = self.client.submit(pb, self.timeout, self.deadline)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise SolveCancelled("Solve cancelled")
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._future is not None:
+                self._future.cancel()
+            callbacks = list(self._cancel_callbacks)
+        for callback in callbacks:
+            callback()
+
+    def add_cancel_callback(self, callback: Callable[[], None]):
+        # called at once when the engine is already cancelled
+        with self._lock:
+            if not self.cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def remove_cancel_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._cancel_callbacks:
+                self._cancel_callbacks.remove(callback)
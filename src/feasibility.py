@@ -0,0 +1,85 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from logistic_map import LOCATIONS_MAP
+from metrics import METRICS
+from topology import get_topology
+
+# Static feasibility of an instance, from the topology only: a package needs a
+# truck in its city to reach or leave a location that's not the airport, and
+# an airplane (standing at an airport) to change city; trucks never leave
+# their city and airplanes only fly between airports. Vehicles can go anywhere
+# they are allowed to, so an instance meeting these conditions always has a
+# plan, and one that doesn't has none: the planner is not asked at all.
+
+INFEASIBLE = METRICS.counter("planning_infeasible_total", "Requests without any plan found by the feasibility check, by reason.", ("reason",))
+
+
+class Feasibility:
+    __slots__ = ("reasons",)
+
+    def __init__(self, reasons: List[Tuple[str, str]]):
+        # (reason, message), empty when the instance has a plan
+        self.reasons = reasons
+
+    def __bool__(self) -> bool:
+        return not self.reasons
+
+    @property
+    def message(self) -> str:
+        return "; ".join(message for _, message in self.reasons)
+
+    def __repr__(self) -> str:
+        return "Feasibility(feasible)" if self else f"Feasibility({self.message})"
+
+
+def _names(names: List[str], mask: np.ndarray) -> str:
+    return ", ".join(names[i] for i in np.flatnonzero(mask).tolist())
+
+
+def check_feasibility(
+    input_values: Dict[str, Tuple[int, int]],
+    locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP,
+) -> Feasibility:
+    topology = get_topology(locations_map)
+    names = list(input_values)
+    kinds = np.array([name.split("_")[0] for name in names], dtype=object)
+    ids = np.array(list(input_values.values()), dtype=np.int64).reshape(len(names), 2)
+
+    valid = topology.valid(ids.ravel()).reshape(ids.shape)
+    if not valid.all():
+        INFEASIBLE.inc("unknown_location")
+        return Feasibility([("unknown_location", f"unknown locations for {_names(names, ~valid.all(axis=1))}")])
+    cities = topology.cities(ids.ravel()).reshape(ids.shape)
+    airports = topology.is_airport[ids]
+
+    reasons: List[Tuple[str, str]] = []
+    is_package, is_truck, is_airplane = kinds == "package", kinds == "truck", kinds == "airplane"
+    truck_other_city = is_truck & (cities[:, 0] != cities[:, 1])
+    if truck_other_city.any():
+        reasons.append(("truck_other_city", f"{_names(names, truck_other_city)} can't leave their city"))
+    airplane_not_airport = is_airplane & ~airports.all(axis=1)
+    if airplane_not_airport.any():
+        reasons.append(("airplane_not_airport", f"{_names(names, airplane_not_airport)} can't fly out of or into a location that's not an airport"))
+
+    moving = is_package & (ids[:, 0] != ids[:, 1])
+    other_city = moving & (cities[:, 0] != cities[:, 1])
+    # the package needs a truck where it starts and where it arrives, unless
+    # it's an airplane that picks it up or drops it off at the airport
+    truck_at_start = moving & ~(other_city & airports[:, 0])
+    truck_at_dest = moving & ~(other_city & airports[:, 1])
+    city_count = len(topology.city_names)
+    trucks_in_city = np.bincount(cities[is_truck, 0], minlength=city_count) > 0
+    needing_truck = np.zeros(city_count, dtype=bool)
+    needing_truck[cities[truck_at_start, 0]] = True
+    needing_truck[cities[truck_at_dest, 1]] = True
+    for city in np.flatnonzero(needing_truck & ~trucks_in_city).tolist():
+        in_city = (truck_at_start & (cities[:, 0] == city)) | (truck_at_dest & (cities[:, 1] == city))
+        reasons.append(("no_truck", f"no truck in {topology.city_names[city]} for {_names(names, in_city)}"))
+    if other_city.any() and not (is_airplane & airports[:, 0]).any():
+        reasons.append(("no_airplane", f"no airplane at an airport to fly {_names(names, other_city)} to another city"))
+
+    for reason, _ in reasons:
+        INFEASIBLE.inc(reason)
+    return Feasibility(reasons)
@@ -1,47 +1,36 @@
 
-import asyncio
+from collections import OrderedDict
 from enum import Enum, auto
-from typing import Tuple
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
 
 import logging
-import queue
+import time
 import justpy as jp
 # FOR FUTURE PROJECTS: check out the justpy.react functionality: https://justpy.io/blog/reactivity/
 
 
-import unified_planning as up
-from unified_planning.shortcuts import *
-
-TOTAL_LOCATIONS = 10
-TOTAL_PACKAGES = 5
-TOTAL_TRUCKS = 3
-TOTAL_AIRPLANES = 2
-
-LOCATIONS_MAP = {
-    "city_1": (1, 2, 3),
-    "city_4": (4, 5, 6),
-    "city_7": (7, 8, 9, 10),
-}
-
-DEFAULTS = {
-    "packages": {
-        1:  (1, 4),
-        2:  (2, 5),
-        3:  (2, 6),
-        4:  (8, 4),
-        5:  (8, 5),
-    },
-    "trucks": {
-        1: (1, 1),
-        2: (4, 4),
-        3: (7, 8),
-    },
-    "airplanes": {
-        1: (1, 1),
-        2: (1, 4),
-    }
-}
+from metrics import METRICS
+from logistic_map import MAP_STORE
+from plan_cache import plan_to_cached
+from feasibility import Feasibility
+from input_validation import DESTINATION, FieldError, check_assignment
+from page_updates import PageUpdates, call_in_loop
+from replanning import PreviousSolve
+from simulator import SimulationResult
+from startup import when_serving
+from validation import validate_cached
+
+if TYPE_CHECKING:
+    import unified_planning as up
+
+PAGES_EVICTED = METRICS.counter("gui_pages_evicted_total", "Main pages freed, by reason.", ("reason",))
+
+# rows of objects rendered at once in the page
+OBJECTS_PER_PAGE = 20
+# actions of the plan rendered at once in the page
+PLAN_ACTIONS_PER_PAGE = 50
 
 BUTTON_CLASS = 'bg-transparent hover:bg-blue-500 text-blue-700 font-semibold hover:text-white py-2 px-4 border border-blue-500 hover:border-transparent rounded m-2'
 
@@ -51,19 +40,209 @@ class Mode(Enum):
     OPERATING = auto()
 
 
-class Gui():
-    def __init__(self):
-        # a queue where the interface waits the start
-        self.start_queue = queue.Queue()
+class SessionState():
+    '''
+    The state of the demo for a single justpy session: every browser session
+    has its own input values, plan and components, so concurrent users don't
+    overwrite each other.
+    '''
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.page: Optional[jp.WebPage] = None
 
         self.mode = Mode.GENERATING_PROBLEM
+        # the inputs of the objects in the current page only
         self.jp_components: Optional[Dict[str, Tuple[jp.Input, jp.Input]]] = None
         self.input_values: Dict[str, Tuple[int, int]] = {}
+        # the text of the inputs of every object, also the ones not rendered
+        self.object_values: Dict[str, Tuple[str, str]] = default_object_values()
+        self.objects_page = 0
+        self.objects_div: Optional[jp.Div] = None
+        self.objects_page_p: Optional[jp.P] = None
 
         self.plan = None
+        # the plan simulated on the instance it solves
+        self.plan_check: Optional[SimulationResult] = None
         self.plan_expected = False
+        self.planner_busy = False
+        self.planner_failed = False
+        # the reasons why the instance has no plan, when they are known
+        self.infeasible: Optional[Feasibility] = None
+        # the job solving the last DELIVER, until it's done
+        self.job = None
+        # the last instance solved, the base of the next DELIVER
+        self.previous_solve: Optional[PreviousSolve] = None
 
         self.plan_div: Optional[jp.Div] = None
+        # the messages, then one page of actions of the plan, its pager and the
+        # outcome of the plan (see main_page)
+        self.plan_text_div: Optional[jp.Div] = None
+        self.plan_actions_div: Optional[jp.Div] = None
+        self.plan_pager_div: Optional[jp.Div] = None
+        self.plan_page_p: Optional[jp.P] = None
+        self.plan_end_p: Optional[jp.P] = None
+        self.plan_page = 0
+
+        self.last_access = time.time()
+
+    def reset_execution(self):
+        self.mode = Mode.GENERATING_PROBLEM
+        self.components_disabled(False)
+
+    def update_planning_execution(self):
+        from main_page import PLAN_PART_P_CLASS, PLAN_PART_P_STYLE, render_plan_page
+        if self.plan_div is not None:
+            self.plan_text_div.delete_components()
+            self.plan_end_p.text = ""
+            if self.plan is not None:
+                actions = len(self.plan.actions)
+                _ = jp.P(
+                    a=self.plan_text_div,
+                    text=f"Found a plan of {actions} actions!",
+                    classes=PLAN_PART_P_CLASS,
+                    style=PLAN_PART_P_STYLE,
+                )
+                if self.plan_check is None or self.plan_check.valid:
+                    self.plan_end_p.text = "After this sequence all packages, trucks and airplanes are at the required destination!"
+                elif self.plan_check.failed_step < actions:
+                    self.plan_end_p.text = f"Step {self.plan_check.failed_step + 1} of this sequence can't be done: {self.plan_check.error}!"
+                else:
+                    self.plan_end_p.text = f"After this sequence not everything is at the required destination: {self.plan_check.error}!"
+            elif self.planner_busy:
+                single_p = jp.P(
+                    a=self.plan_text_div,
+                    text="The planner is busy, press DELIVER again in a few seconds!",
+                    classes=PLAN_PART_P_CLASS,
+                    style=PLAN_PART_P_STYLE,
+                )
+            elif self.planner_failed:
+                single_p = jp.P(
+                    a=self.plan_text_div,
+                    text="The planner did not answer in time, press DELIVER to try again!",
+                    classes=PLAN_PART_P_CLASS,
+                    style=PLAN_PART_P_STYLE,
+                )
+            elif self.plan_expected:
+                if self.mode == Mode.GENERATING_PROBLEM and self.infeasible is not None:
+                    single_p = jp.P(
+                        a=self.plan_text_div,
+                        text=f"There is no plan: {self.infeasible.message}!",
+                        classes=PLAN_PART_P_CLASS,
+                        style=PLAN_PART_P_STYLE,
+                    )
+                elif self.mode == Mode.GENERATING_PROBLEM:
+                    single_p = jp.P(
+                        a=self.plan_text_div,
+                        text="No plan found; Are you sure that every city has a truck to deliver packages and that Trucks are not required to move between different cities?",
+                        classes=PLAN_PART_P_CLASS,
+                        style=PLAN_PART_P_STYLE,
+                    )
+                else:
+                    single_p = jp.P(
+                        a=self.plan_text_div,
+                        text="Wait for planning to finish!",
+                        classes=PLAN_PART_P_CLASS,
+                        style=PLAN_PART_P_STYLE,
+                    )
+            else:
+                single_p = jp.P(
+                    a=self.plan_text_div,
+                    text="Define start and destinations and press DELIVER!",
+                    classes=PLAN_PART_P_CLASS,
+                    style=PLAN_PART_P_STYLE,
+                )
+            # a new plan is shown from its first page, or from the page of the
+            # step that can't be done
+            self.plan_page = 0
+            check = self.plan_check
+            if self.plan is not None and check is not None and not check.valid and check.failed_step >= 0:
+                self.plan_page = min(check.failed_step // PLAN_ACTIONS_PER_PAGE, self.plan_pages() - 1)
+            # sent by the caller: with the page after an event, or published
+            # to the page by Gui.planning_done
+            render_plan_page(self)
+
+    def plan_pages(self) -> int:
+        if self.plan is None:
+            return 0
+        return max(1, -(-len(self.plan.actions) // PLAN_ACTIONS_PER_PAGE))
+
+    def show_plan_page(self, page: int) -> bool:
+        # False when the page is already shown
+        from main_page import render_plan_page
+        page = min(max(page, 0), self.plan_pages() - 1)
+        if page == self.plan_page or self.plan_actions_div is None:
+            return False
+        self.plan_page = page
+        render_plan_page(self)
+        return True
+
+    def components_disabled(self, disabled: bool):
+        if self.jp_components is None:
+            return
+        for c1, c2 in self.jp_components.values():
+            c1.disabled = disabled
+            c2.disabled = disabled
+
+    def store_visible_values(self):
+        if self.jp_components is None:
+            return
+        for k, (jp_start_text, jp_dest_text) in self.jp_components.items():
+            self.object_values[k] = (str(jp_start_text.value), str(jp_dest_text.value))
+
+    def show_objects_page(self, page: int):
+        from main_page import render_objects_page
+        pages = max(1, -(-len(MAP_STORE.fleet) // OBJECTS_PER_PAGE))
+        self.store_visible_values()
+        self.objects_page = min(max(page, 0), pages - 1)
+        if self.objects_div is not None:
+            render_objects_page(self)
+
+    def input_errors(self, errors: List[FieldError]):
+        # every error is shown in its input, from the page of the first one
+        index = next(i for i, o in enumerate(MAP_STORE.fleet) if o.name == errors[0].name)
+        self.show_objects_page(index // OBJECTS_PER_PAGE)
+        for error in errors:
+            start_text, dest_text = self.object_values[error.name]
+            text = f"Err: {error.code}"
+            if error.field == DESTINATION:
+                self.object_values[error.name] = (start_text, text)
+            else:
+                self.object_values[error.name] = (text, dest_text)
+            if self.jp_components is not None and error.name in self.jp_components:
+                self.jp_components[error.name][1 if error.field == DESTINATION else 0].value = text
+
+    def validate_input(self) -> bool:
+        self.input_values = {}
+        if self.jp_components is None:
+            return False
+        self.store_visible_values()
+        check = check_assignment(self.object_values)
+        if not check:
+            self.input_errors(check.errors)
+            return False
+        self.input_values = check.input_values
+        return True
+
+
+class Gui():
+    def __init__(self):
+        # the PlanningScheduler that solves the problems submitted with DELIVER
+        self.scheduler = None
+        # solve again only the objects changed since the last DELIVER
+        self.incremental_replanning = True
+        # the page of every session, subscribed to the updates of its session
+        self.page_updates = PageUpdates()
+
+        # the state of every session, by justpy session id
+        self.sessions: Dict[str, SessionState] = {}
+        self.sessions_lock = Lock()
+        # the main pages served, by page id, least recently used first; among
+        # the pages without open websocket, the ones idle for page_idle_timeout
+        # seconds, and the oldest ones beyond max_pages, are freed together
+        # with the sessions left without pages
+        self.pages: "OrderedDict[int, Tuple[SessionState, jp.WebPage, float]]" = OrderedDict()
+        self.max_pages = 256
+        self.page_idle_timeout = 3600.0
 
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(format='%(asctime)s %(message)s')
@@ -112,134 +291,208 @@ class Gui():
         #     style='max-width: 100%; height: auto;'
         # )
 
-    def reset_execution(self):
-        self.mode = Mode.GENERATING_PROBLEM
-        self.components_disabled(False)
+    def previous_objects_click(self, msg):
+        session = self.msg_session(msg)
+        session.show_objects_page(session.objects_page - 1)
 
-    def update_planning_execution(self):
-        from main_page import PLAN_PART_P_CLASS, PLAN_PART_P_STYLE
-        if self.plan_div is not None:
-            self.plan_div.delete_components()
-            if self.plan is not None:
-                _ = jp.P(
-                    a=self.plan_div,
-                    text=f"Found a plan!",
-                    classes=PLAN_PART_P_CLASS,
-                    style=PLAN_PART_P_STYLE,
-                )
-                for action_instance in self.plan.actions:
-                    text = write_action_instance(action_instance)
-                    _ = jp.P(
-                        a=self.plan_div,
-                        text=text,
-                        classes=PLAN_PART_P_CLASS,
-                        style=PLAN_PART_P_STYLE,
-                    )
-                _ = jp.P(
-                    a=self.plan_div,
-                    text=f"After this sequence all packages, trucks and airplanes are at the required destination!",
-                    classes=PLAN_PART_P_CLASS,
-                    style=PLAN_PART_P_STYLE,
-                )
+    def next_objects_click(self, msg):
+        session = self.msg_session(msg)
+        session.show_objects_page(session.objects_page + 1)
 
-            elif self.plan_expected:
-                if self.mode == Mode.GENERATING_PROBLEM:
-                    single_p = jp.P(
-                        a=self.plan_div,
-                        text="No plan found; Are you sure that every city has a truck to deliver packages and that Trucks are not required to move between different cities?",
-                        classes=PLAN_PART_P_CLASS,
-                        style=PLAN_PART_P_STYLE,
-                    )
-                else:
-                    single_p = jp.P(
-                        a=self.plan_div,
-                        text="Wait for planning to finish!",
-                        classes=PLAN_PART_P_CLASS,
-                        style=PLAN_PART_P_STYLE,
-                    )
-            else:
-                single_p = jp.P(
-                    a=self.plan_div,
-                    text="Define start and destinations and press DELIVER!",
-                    classes=PLAN_PART_P_CLASS,
-                    style=PLAN_PART_P_STYLE,
-                )
-            try:
-                asyncio.run(self.plan_div.update())
-            except RuntimeError:
-                self.plan_div.update()
+    async def previous_plan_click(self, msg):
+        await self.plan_page_click(msg, -1)
+        # only the plan page has been sent, not the whole page
+        return True
+
+    async def next_plan_click(self, msg):
+        await self.plan_page_click(msg, 1)
+        return True
+
+    async def plan_page_click(self, msg, step: int):
+        session = self.msg_session(msg)
+        if session.show_plan_page(session.plan_page + step):
+            await session.plan_actions_div.update(msg.websocket)
+            await session.plan_pager_div.update(msg.websocket)
+
+    def get_session(self, session_id: str) -> SessionState:
+        with self.sessions_lock:
+            session = self.sessions.get(session_id, None)
+            if session is None:
+                session = SessionState(session_id)
+                self.sessions[session_id] = session
+            session.last_access = time.time()
+            return session
+
+    def msg_session(self, msg) -> SessionState:
+        # the session key is stored on the page by main_page
+        self.touch_page(msg.page)
+        return self.get_session(msg.page.session_key)
 
     def clear_activities_click(self, msg):
         self.logger.info("Clearing")
-        if self.mode == Mode.GENERATING_PROBLEM:
-            self.plan = None
-            self.input_values = {}
-            self.plan_expected = False
-            self.update_planning_execution()
-
-    def show_gui_thread(self):
+        session = self.msg_session(msg)
+        if session.mode == Mode.OPERATING:
+            # stop waiting for the planner
+            self.cancel_planning(session)
+            session.reset_execution()
+        if session.mode == Mode.GENERATING_PROBLEM:
+            session.plan = None
+            session.input_values = {}
+            session.plan_expected = False
+            session.planner_busy = False
+            session.planner_failed = False
+            session.infeasible = None
+            session.update_planning_execution()
+
+    def cancel_planning(self, session: SessionState):
+        job = session.job
+        if job is not None:
+            self.logger.info(f"Cancelling job {job.job_id}")
+            session.job = None
+            job.cancel()
+
+    def page_connected(self, session: SessionState, page: jp.WebPage):
+        # the components of the session are the ones of its last page
+        if session.page is not None:
+            self.page_updates.unsubscribe(session.session_id, session.page)
+        session.page = page
+        self.page_updates.subscribe(session.session_id, page)
+        with self.sessions_lock:
+            self.pages[page.page_id] = (session, page, time.time())
+        self.evict_pages()
+
+    def touch_page(self, page: jp.WebPage):
+        with self.sessions_lock:
+            entry = self.pages.get(page.page_id, None)
+            if entry is not None:
+                self.pages[page.page_id] = (entry[0], entry[1], time.time())
+                self.pages.move_to_end(page.page_id)
+
+    def evict_pages(self, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        evicted = []
+        with self.sessions_lock:
+            count = len(self.pages)
+            # least recently seen first
+            for page_id, (session, page, last_seen) in list(self.pages.items()):
+                idle = now - last_seen > self.page_idle_timeout
+                if not idle and count <= self.max_pages:
+                    break
+                # a page with an open websocket is never freed, even over the
+                # limit: justpy still looks it up when the websocket closes
+                if jp.WebPage.sockets.get(page_id):
+                    continue
+                del self.pages[page_id]
+                count -= 1
+                evicted.append((session, page, "idle" if idle else "limit"))
+        for session, page, reason in evicted:
+            self.remove_page(session, page)
+            PAGES_EVICTED.inc(reason)
+
+    def remove_page(self, session: SessionState, page: jp.WebPage):
+        self.page_disconnected(session, page)
+        page.delete_components()
+        jp.WebPage.instances.pop(page.page_id, None)
+        if session.page is page:
+            with self.sessions_lock:
+                # the state of the session goes with its last page
+                if self.sessions.get(session.session_id, None) is session:
+                    del self.sessions[session.session_id]
+
+    def page_disconnected(self, session: SessionState, page: jp.WebPage):
+        self.page_updates.unsubscribe(session.session_id, page)
+        # the page is idle from when it lost its websocket
+        self.touch_page(page)
+        # nobody is waiting for the plan anymore, unless the session opened another page
+        if session.page is page and session.mode == Mode.OPERATING:
+            self.cancel_planning(session)
+            session.reset_execution()
+            session.plan_expected = False
+
+    def show_gui_thread(self, on_serving: Optional[Callable[[], None]] = None):
+        # on_serving is called, from the event loop, once the port is open
         from main_page import main_page
         @jp.SetRoute("/")
-        def get_main_page():
-            return main_page(self)
-        jp.justpy(get_main_page)
+        def get_main_page(request):
+            return main_page(self, getattr(request, "session_id", None))
+
+        def startup():
+            if on_serving is not None:
+                # justpy starts up before uvicorn binds the port
+                jp.WebPage.loop.create_task(when_serving(jp.jpconfig.HOST, jp.jpconfig.PORT, on_serving))
+        jp.justpy(get_main_page, startup=startup)
 
     def generate_problem_click(self, msg):
         self.logger.info("Generating")
-        if self.mode == Mode.GENERATING_PROBLEM:
-            self.mode = Mode.OPERATING
-            self.components_disabled(True)
-            if self.validate_input():
+        session = self.msg_session(msg)
+        if session.mode == Mode.GENERATING_PROBLEM:
+            session.mode = Mode.OPERATING
+            session.components_disabled(True)
+            if session.validate_input():
                 self.logger.info("Valid input")
-                self.plan = None
-                self.plan_expected = True
-                self.update_planning_execution()
-                # unlock the planing method with the problem correctly generated
-                self.start_queue.put(None)
+                session.plan = None
+                session.plan_expected = True
+                session.planner_busy = False
+                session.planner_failed = False
+                session.infeasible = None
+                session.update_planning_execution()
+                self.submit_planning(session)
             else:
                 self.logger.info("Invalid input")
-                self.mode = Mode.GENERATING_PROBLEM
-                self.input_values = {}
-                self.components_disabled(False)
-
-    def components_disabled(self, disabled: bool):
-        for c1, c2 in self.jp_components.values():
-            c1.disabled = disabled
-            c2.disabled = disabled
-
-    def validate_input(self) -> bool:
-        self.input_values = {}
-        if self.jp_components is None:
-            return False
-        for k, (jp_start_text, jp_dest_text) in self.jp_components.items():
-            start_text, dest_text = jp_start_text.value, jp_dest_text.value
-            try:
-                start_value = int(start_text)
-            except ValueError:
-                jp_start_text.value = "Err: NAN"
-                return False
-            if start_value < 1:
-                jp_start_text.value = "Err: < 1"
-                return False
-            elif start_value > TOTAL_LOCATIONS:
-                jp_start_text.value = f"Err: > {TOTAL_LOCATIONS}"
-                return False
-            try:
-                dest_value = int(dest_text)
-            except ValueError:
-                jp_dest_text.value = "Err: NAN"
-                return False
-            if dest_value < 1:
-                jp_dest_text.value = "Err: < 1"
-                return False
-            elif dest_value > TOTAL_LOCATIONS:
-                jp_dest_text.value = f"Err: > {TOTAL_LOCATIONS}"
-                return False
-            self.input_values[k] = (start_value, dest_value)
-        return True
-
+                session.mode = Mode.GENERATING_PROBLEM
+                session.input_values = {}
+                session.components_disabled(False)
+
+    def submit_planning(self, session: SessionState):
+        from scheduler import SchedulerBusy
+        try:
+            previous = session.previous_solve if self.incremental_replanning else None
+            session.job = self.scheduler.submit(session.input_values, session, self.planning_done, previous=previous)
+        except SchedulerBusy:
+            self.logger.info("Planner busy")
+            session.plan_expected = False
+            session.planner_busy = True
+            session.reset_execution()
+            session.update_planning_execution()
+
+    def planning_done(self, job):
+        # called by the worker of the scheduler: the plan is checked here, the
+        # components are only changed from the event loop of justpy
+        plan_check, previous_solve = None, None
+        if not job.cancelled and job.plan is not None:
+            cached = plan_to_cached(job.plan)
+            plan_check = validate_cached(job.input_values, cached)
+            if plan_check.valid:
+                previous_solve = PreviousSolve(job.input_values, cached)
+            else:
+                self.logger.warning(f"Plan of job {job.job_id} is not valid: {plan_check}")
+        call_in_loop(self.show_plan, job, plan_check, previous_solve)
 
-def write_action_instance(action_instance: up.plans.ActionInstance) -> str:
+    def show_plan(self, job, plan_check: Optional[SimulationResult], previous_solve: Optional[PreviousSolve]):
+        session: SessionState = job.session
+        if job.cancelled:
+            return
+        if session.job is job:
+            session.job = None
+        session.plan = job.plan
+        session.plan_check = plan_check
+        # errors are timeouts, or the planner not answering at all
+        session.planner_failed = job.error is not None
+        session.infeasible = job.infeasible
+        if previous_solve is not None:
+            session.previous_solve = previous_solve
+        with job.trace.stage("render"):
+            session.update_planning_execution()
+            session.reset_execution()
+            # only the plan and the (enabled again) inputs of the session change
+            self.page_updates.publish(session.session_id, session.plan_div, session.objects_div)
+
+def default_object_values() -> Dict[str, Tuple[str, str]]:
+    return {o.name: (str(o.start), str(o.destination)) for o in MAP_STORE.fleet}
+
+
+def write_action_instance(action_instance: "up.plans.ActionInstance") -> str:
     params = action_instance.actual_parameters
     if action_instance.action.name == "load":
         return f" - LOAD {params[0]} ONTO {params[1]} FROM {params[2]}"
@@ -251,8 +504,3 @@ def write_action_instance(action_instance: up.plans.ActionInstance) -> str:
         return f" - {params[0]} : {params[1]} ---> {params[2]}"
     else:
         return str(action_instance)
-
-async def reload_page():
-    for page in jp.WebPage.instances.values():
-        if page.page_type == 'main':
-            await page.reload()
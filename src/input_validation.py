@@ -0,0 +1,110 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logistic_map import LOCATIONS_MAP
+from map_store import KINDS
+from topology import get_topology
+
+# Validation of a whole fleet assignment (object name -> (start, destination),
+# as typed in the page or read from a batch file) in one pass: the fields are
+# parsed, then the range, location and city checks run as array operations
+# over all the objects, and every wrong field is reported, not only the first.
+#
+# Besides unknown locations, the assignments that no planner can solve for a
+# single object are rejected here: a truck can't leave its city, and an
+# airplane only stands at and flies between airports.
+
+START, DESTINATION = "start", "destination"
+
+
+class FieldError:
+    __slots__ = ("name", "field", "code", "message")
+
+    def __init__(self, name: str, field: str, code: str, message: str):
+        self.name = name
+        # START, DESTINATION, or "object" for the name itself
+        self.field = field
+        # short text shown in the input of the page
+        self.code = code
+        self.message = message
+
+    def to_json(self) -> Dict[str, str]:
+        return {"object": self.name, "field": self.field, "error": self.message}
+
+    def __repr__(self) -> str:
+        return f"FieldError({self.name}.{self.field}: {self.message})"
+
+
+class InputCheck:
+    __slots__ = ("input_values", "errors")
+
+    def __init__(self, input_values: Dict[str, Tuple[int, int]], errors: List[FieldError]):
+        # the parsed assignment, empty when there are errors
+        self.input_values = input_values
+        self.errors = errors
+
+    def __bool__(self) -> bool:
+        return not self.errors
+
+
+def _parse(value: Any) -> Optional[int]:
+    # None for anything that's not an integer
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+def check_assignment(
+    values: Dict[str, Tuple[Any, Any]],
+    locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP,
+) -> InputCheck:
+    topology = get_topology(locations_map)
+    names = list(values)
+    count = len(names)
+    flat = [_parse(v) for pair in values.values() for v in pair]
+    parsed = np.array([v is not None for v in flat], dtype=bool).reshape(count, 2)
+    ids = np.array([0 if v is None else v for v in flat], dtype=np.int64).reshape(count, 2)
+    kinds = np.array([name.split("_")[0] for name in names], dtype=object)
+
+    valid = topology.valid(ids.ravel()).reshape(count, 2)
+    cities = np.where(valid, topology.city_of[np.where(valid, ids, 0)], -1)
+    airports = valid & topology.is_airport[np.where(valid, ids, 0)]
+    is_truck, is_airplane = kinds == "truck", kinds == "airplane"
+    both_valid = valid.all(axis=1)
+    truck_other_city = is_truck & both_valid & (cities[:, 0] != cities[:, 1])
+    airplane_not_airport = is_airplane[:, None] & valid & ~airports
+
+    errors: List[FieldError] = []
+    bad_rows = ~both_valid | truck_other_city | airplane_not_airport.any(axis=1) | ~np.isin(kinds, KINDS)
+    max_id = topology.max_location_id
+    for i in np.flatnonzero(bad_rows).tolist():
+        name = names[i]
+        if kinds[i] not in KINDS:
+            errors.append(FieldError(name, "object", "type", f"unknown object type {kinds[i]}"))
+            continue
+        for column, field in ((0, START), (1, DESTINATION)):
+            location = int(ids[i, column])
+            if not parsed[i, column]:
+                errors.append(FieldError(name, field, "NAN", f"{field} {values[name][column]!r} is not a number"))
+            elif location < 1:
+                errors.append(FieldError(name, field, "< 1", f"{field} {location} is lower than 1"))
+            elif location > max_id:
+                errors.append(FieldError(name, field, f"> {max_id}", f"{field} {location} is greater than {max_id}"))
+            elif not valid[i, column]:
+                errors.append(FieldError(name, field, "unknown", f"{field} {location} is not a location of the map"))
+            elif airplane_not_airport[i, column]:
+                errors.append(FieldError(name, field, "no airport", f"{field} {location} is not an airport"))
+        if truck_other_city[i]:
+            start_city, dest_city = topology.city_name(int(ids[i, 0])), topology.city_name(int(ids[i, 1]))
+            errors.append(FieldError(
+                name, DESTINATION, "other city",
+                f"destination {int(ids[i, 1])} is in {dest_city}, the truck can't leave {start_city}",
+            ))
+    if errors:
+        return InputCheck({}, errors)
+    input_values = {name: (int(start), int(dest)) for name, (start, dest) in zip(names, ids.tolist())}
+    return InputCheck(input_values, errors)
@@ -0,0 +1,41 @@
+# The map and the fleet of the logistic demo; kept apart from the gui so that
+# the planning code can be used without justpy.
+
+import os
+
+from map_store import MapStore, fleet_from_defaults, load_map_store
+
+LOCATIONS_MAP = {
+    "city_1": (1, 2, 3),
+    "city_4": (4, 5, 6),
+    "city_7": (7, 8, 9, 10),
+}
+
+DEFAULTS = {
+    "packages": {
+        1:  (1, 4),
+        2:  (2, 5),
+        3:  (2, 6),
+        4:  (8, 4),
+        5:  (8, 5),
+    },
+    "trucks": {
+        1: (1, 1),
+        2: (4, 4),
+        3: (7, 8),
+    },
+    "airplanes": {
+        1: (1, 1),
+        2: (1, 4),
+    }
+}
+
+# A bigger map and fleet can be loaded from data files (see map_store.py)
+MAP_FILE = os.environ.get("LOGISTIC_MAP_FILE", None)
+FLEET_FILE = os.environ.get("LOGISTIC_FLEET_FILE", None)
+
+if MAP_FILE is not None:
+    MAP_STORE = load_map_store(MAP_FILE, FLEET_FILE)
+    LOCATIONS_MAP = MAP_STORE.locations_map
+else:
+    MAP_STORE = MapStore(LOCATIONS_MAP, fleet_from_defaults(DEFAULTS))
@@ -1,9 +1,9 @@
 
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 import justpy as jp
 
-from gui import Gui, TOTAL_PACKAGES, TOTAL_AIRPLANES, TOTAL_TRUCKS, DEFAULTS
+from gui import Gui, Mode, SessionState, MAP_STORE, OBJECTS_PER_PAGE, PLAN_ACTIONS_PER_PAGE, write_action_instance
 
 LEFT_MARGIN, RIGHT_MARGIN = " margin-left: 10px; ", " margin-right: 20px; "
 
@@ -60,59 +60,168 @@ CLEAR_SOLVE_BUTTONS_DIV_STYLE = f"column-gap: {COL_GAP}px;"
 CLEAR_SOLVE_BUTTONS_CLASS = ADD_BUTTON_CLASS
 CLEAR_SOLVE_BUTTONS_STYLE = "font-weight: semibold; font-size: 20px;"
 
+OBJECTS_DIV_CLASS = "grid grid-cols-3 col-span-3"
+OBJECTS_DIV_STYLE = f"column-gap: 4px;"
+
+OBJECTS_PAGE_P_STYLE = "font-size: 16px; font-weight: normal; margin-top: 15px; text-align: center;"
+
 PLAN_DIV_CLASS = ""
 PLAN_DIV_STYLE = f"font-size: 30px; font-weight: semibold;"
 
 PLAN_PART_P_CLASS = ""
 PLAN_PART_P_STYLE = f"font-weight: normal; font-size: 18px;"
 
+PLAN_PAGER_DIV_CLASS = "flex"
+PLAN_PAGE_P_STYLE = "font-size: 16px; font-weight: normal; margin-top: 15px; text-align: center; width: 200px;"
 
-def main_page(gui: Gui):
-    wp = jp.WebPage(delete_flag = False)
-    wp.page_type = 'main'
-    title_div = jp.Div(
-        a=wp,
-        classes=TITLE_DIV_CLASS,
-        style=TITLE_DIV_STYLE,
-    )
-    fbk_logo_div = jp.Div(
-        a=title_div,
-        # text="FBK LOGO",
-        # style="font-size: 30px;",
-        style="height: 160px;",
-    )
-    fbk_logo = jp.Img(
-        src="/static/logos/fbk.png",
-        a=fbk_logo_div,
-        classes="w3-image",
-        # style="height: 100%; length: auto;",
-    )
-    title_text_div = jp.Div(
-        a=title_div,
-        text="LOGISTIC",
-        style=TITLE_TEXT_DIV_STYLE,
-    )
-    unified_planning_logo_div = jp.Div(
-        a=title_div,
-        style="height: 160px;",
-    )
-    unified_planning = jp.Img(
-        src="/static/logos/unified_planning_logo.png",
-        a=unified_planning_logo_div,
-        classes="w3-image",
-        style="max-width: 100%; height: 160px;"
-    )
 
-    description_div = jp.Div(
-        a=wp,
-        style=DESCRIPTION_STYLE,
-    )
-    for single_desc in DESCRIPTION_TEXT.split("\n"):
-        description_paragraph = jp.P(
-            a=description_div,
-            style=SINGLE_DESCRIPTION_STYLE,
-            text=single_desc,
+def render_objects_page(session: SessionState):
+    objects_div = session.objects_div
+    objects_div.delete_components()
+    first = session.objects_page * OBJECTS_PER_PAGE
+    page_objects = MAP_STORE.fleet[first:first + OBJECTS_PER_PAGE]
+    jp_components: Dict[str, Tuple[jp.Input, jp.Input]] = {}
+    for fleet_object in page_objects:
+        object_i_text = jp.P(
+            a=objects_div,
+            text=fleet_object.label,
+            classes=OBJECT_NAME_P_CLASS,
+            style=OBJECT_NAME_P_STYLE,
         )
+        object_i_start = jp.Input(
+            a=objects_div,
+            classes=TEXT_INPUT_P_CLASS,
+            style=TEXT_INPUT_P_STYLE,
+        )
+        object_i_destination = jp.Input(
+            a=objects_div,
+            classes=TEXT_INPUT_P_CLASS,
+            style=TEXT_INPUT_P_STYLE,
+        )
+        object_i_start.value, object_i_destination.value = session.object_values[fleet_object.name]
+        jp_components[fleet_object.name] = (object_i_start, object_i_destination)
+    session.jp_components = jp_components
+    session.components_disabled(session.mode != Mode.GENERATING_PROBLEM)
+    if session.objects_page_p is not None:
+        last = first + len(page_objects)
+        session.objects_page_p.text = f"{first + 1}-{last} of {len(MAP_STORE.fleet)}"
+
+
+def render_plan_page(session: SessionState):
+    plan_actions_div = session.plan_actions_div
+    plan_actions_div.delete_components()
+    actions = session.plan.actions if session.plan is not None else []
+    first = session.plan_page * PLAN_ACTIONS_PER_PAGE
+    for action_instance in actions[first:first + PLAN_ACTIONS_PER_PAGE]:
+        _ = jp.P(
+            a=plan_actions_div,
+            text=write_action_instance(action_instance),
+            classes=PLAN_PART_P_CLASS,
+            style=PLAN_PART_P_STYLE,
+        )
+    session.plan_pager_div.show = len(actions) > PLAN_ACTIONS_PER_PAGE
+    if session.plan_pager_div.show:
+        last = min(first + PLAN_ACTIONS_PER_PAGE, len(actions))
+        session.plan_page_p.text = f"{first + 1}-{last} of {len(actions)}"
+
+
+_static_components: Optional[Tuple[jp.Div, jp.Div, jp.Div]] = None
+
+
+def static_components() -> Tuple[jp.Div, jp.Div, jp.Div]:
+    # the title, the description and the map are the same in every page: they
+    # are built once and shared, without events and never deleted with a page
+    global _static_components
+    if _static_components is None:
+        title_div = jp.Div(
+            delete_flag=False,
+            classes=TITLE_DIV_CLASS,
+            style=TITLE_DIV_STYLE,
+        )
+        fbk_logo_div = jp.Div(
+            delete_flag=False,
+            a=title_div,
+            # text="FBK LOGO",
+            # style="font-size: 30px;",
+            style="height: 160px;",
+        )
+        fbk_logo = jp.Img(
+            delete_flag=False,
+            src="/static/logos/fbk.png",
+            a=fbk_logo_div,
+            classes="w3-image",
+            # style="height: 100%; length: auto;",
+        )
+        title_text_div = jp.Div(
+            delete_flag=False,
+            a=title_div,
+            text="LOGISTIC",
+            style=TITLE_TEXT_DIV_STYLE,
+        )
+        unified_planning_logo_div = jp.Div(
+            delete_flag=False,
+            a=title_div,
+            style="height: 160px;",
+        )
+        unified_planning = jp.Img(
+            delete_flag=False,
+            src="/static/logos/unified_planning_logo.png",
+            a=unified_planning_logo_div,
+            classes="w3-image",
+            style="max-width: 100%; height: 160px;"
+        )
+
+        description_div = jp.Div(
+            delete_flag=False,
+            style=DESCRIPTION_STYLE,
+        )
+        for single_desc in DESCRIPTION_TEXT.split("\n"):
+            description_paragraph = jp.P(
+                delete_flag=False,
+                a=description_div,
+                style=SINGLE_DESCRIPTION_STYLE,
+                text=single_desc,
+            )
+
+        goals_div = jp.Div(
+            delete_flag=False,
+            text="MAP:",
+            classes=GOALS_DIV_CLASS,
+            style=GOALS_DIV_STYLE,
+        )
+
+        graph_image_div = jp.Div(
+            delete_flag=False,
+            a=goals_div,
+            classes="",
+            style="",
+        )
+        img = jp.Img(
+            delete_flag=False,
+            src="/static/logos/logistic_map.png",
+            a=graph_image_div,
+            classes="w3-image",
+            style="max-width: 100%; height: 400px;"
+        )
+        _static_components = (title_div, description_div, goals_div)
+    return _static_components
+
+
+def main_page(gui: Gui, session_id: Optional[str] = None):
+    wp = jp.WebPage(delete_flag = False)
+    wp.page_type = 'main'
+    # without justpy sessions every page gets its own state
+    wp.session_key = session_id if session_id is not None else f"page_{wp.page_id}"
+    session = gui.get_session(wp.session_key)
+    gui.page_connected(session, wp)
+    page_on_disconnect = wp.on_disconnect
+
+    async def on_disconnect(websocket=None):
+        gui.page_disconnected(session, wp)
+        await page_on_disconnect(websocket)
+    wp.on_disconnect = on_disconnect
+    title_div, description_div, goals_div = static_components()
+    wp.add(title_div, description_div)
 
     main_body_div = jp.Div(
         a=wp,
@@ -152,81 +261,40 @@ def main_page(gui: Gui):
         classes=HEADERS_P_CLASS,
         style=HEADERS_P_STYLE,
     )
-    jp_components: Dict[str, Tuple[jp.Input, jp.Input]] = {}
-    pkg_default = DEFAULTS["packages"]
-    for i in range(1, TOTAL_PACKAGES+1):
-        package_i_text = jp.P(
-            a=actions_div,
-            text=f"Package {i}",
-            classes=OBJECT_NAME_P_CLASS,
-            style=OBJECT_NAME_P_STYLE,
-        )
-        package_i_start = jp.Input(
-            a=actions_div,
-            classes=TEXT_INPUT_P_CLASS,
-            style=TEXT_INPUT_P_STYLE,
-        )
-        package_i_destination = jp.Input(
-            a=actions_div,
-            classes=TEXT_INPUT_P_CLASS,
-            style=TEXT_INPUT_P_STYLE,
-        )
-        key = f"package_{i}"
-        if gui.input_values:
-            package_i_start.value, package_i_destination.value = gui.input_values[key]
-        else:
-            package_i_start.value, package_i_destination.value = map(str, pkg_default[i])
-        jp_components[key] = (package_i_start, package_i_destination)
-    trucks_default = DEFAULTS["trucks"]
-    for i in range(1, TOTAL_TRUCKS+1):
-        truck_i_text = jp.P(
-            a=actions_div,
-            text=f"Truck {i}",
-            classes=OBJECT_NAME_P_CLASS,
-            style=OBJECT_NAME_P_STYLE,
-        )
-        truck_i_start = jp.Input(
-            a=actions_div,
-            classes=TEXT_INPUT_P_CLASS,
-            style=TEXT_INPUT_P_STYLE,
-        )
-        truck_i_destination = jp.Input(
-            a=actions_div,
-            classes=TEXT_INPUT_P_CLASS,
-            style=TEXT_INPUT_P_STYLE,
-        )
-        key = f"truck_{i}"
-        if gui.input_values:
-            truck_i_start.value, truck_i_destination.value = gui.input_values[key]
-        else:
-            truck_i_start.value, truck_i_destination.value = map(str, trucks_default[i])
-        jp_components[key] = (truck_i_start, truck_i_destination)
-    airplanes_default = DEFAULTS["airplanes"]
-    for i in range(1, TOTAL_AIRPLANES+1):
-        airplane_i_text = jp.P(
-            a=actions_div,
-            text=f"Airplane {i}",
-            classes=OBJECT_NAME_P_CLASS,
-            style=OBJECT_NAME_P_STYLE,
-        )
-        airplane_i_start = jp.Input(
-            a=actions_div,
-            classes=TEXT_INPUT_P_CLASS,
-            style=TEXT_INPUT_P_STYLE,
-        )
-        airplane_i_destination = jp.Input(
-            a=actions_div,
-            classes=TEXT_INPUT_P_CLASS,
-            style=TEXT_INPUT_P_STYLE,
-        )
-        key = f"airplane_{i}"
-        if gui.input_values:
-            airplane_i_start.value, airplane_i_destination.value = gui.input_values[key]
-        else:
-            airplane_i_start.value, airplane_i_destination.value = map(str, airplanes_default[i])
-        jp_components[key] = (airplane_i_start, airplane_i_destination)
+    # the rows of the objects are paged, only one page of inputs is rendered
+    objects_div = jp.Div(
+        a=actions_div,
+        classes=OBJECTS_DIV_CLASS,
+        style=OBJECTS_DIV_STYLE,
+    )
+    session.objects_div = objects_div
+
+    previous_page = jp.Input(
+        a=actions_div,
+        value="<",
+        type="submit",
+        classes=ADD_BUTTON_CLASS,
+        style=ADD_BUTTON_STYLE,
+    )
+    previous_page.on('click', gui.previous_objects_click)
+    objects_page_p = jp.P(
+        a=actions_div,
+        classes=HEADERS_P_CLASS,
+        style=OBJECTS_PAGE_P_STYLE,
+    )
+    session.objects_page_p = objects_page_p
+    next_page = jp.Input(
+        a=actions_div,
+        value=">",
+        type="submit",
+        classes=ADD_BUTTON_CLASS,
+        style=ADD_BUTTON_STYLE,
+    )
+    next_page.on('click', gui.next_objects_click)
+    if len(MAP_STORE.fleet) <= OBJECTS_PER_PAGE:
+        previous_page.show = objects_page_p.show = next_page.show = False
 
-    gui.jp_components = jp_components
+    render_objects_page(session)
 
     # placeholder
     _ = jp.P(
@@ -249,32 +317,54 @@ def main_page(gui: Gui):
     )
     solve.on('click', gui.generate_problem_click)
 
-    goals_div = jp.Div(
-        a=main_body_div,
-        text="MAP:",
-        classes=GOALS_DIV_CLASS,
-        style=GOALS_DIV_STYLE,
-    )
+    main_body_div.add(goals_div)
 
-    graph_image_div = jp.Div(
-        a=goals_div,
-        classes="",
-        style="",
-    )
-    img = jp.Img(
-        src="/static/logos/logistic_map.png",
-        a=graph_image_div,
-        classes="w3-image",
-        style="max-width: 100%; height: 400px;"
-    )
     plan_div = jp.Div(
         a=main_body_div,
         text="PLAN:",
         classes=PLAN_DIV_CLASS,
         style=PLAN_DIV_STYLE,
     )
-    gui.plan_div = plan_div
+    session.plan_div = plan_div
+    session.plan_text_div = jp.Div(
+        a=plan_div,
+    )
+    # the actions of the plan are paged, only one page is sent to the browser
+    session.plan_actions_div = jp.Div(
+        a=plan_div,
+    )
+    plan_pager_div = jp.Div(
+        a=plan_div,
+        classes=PLAN_PAGER_DIV_CLASS,
+    )
+    session.plan_pager_div = plan_pager_div
+    previous_plan_page = jp.Input(
+        a=plan_pager_div,
+        value="<",
+        type="submit",
+        classes=ADD_BUTTON_CLASS,
+        style=ADD_BUTTON_STYLE,
+    )
+    previous_plan_page.on('click', gui.previous_plan_click)
+    session.plan_page_p = jp.P(
+        a=plan_pager_div,
+        classes=HEADERS_P_CLASS,
+        style=PLAN_PAGE_P_STYLE,
+    )
+    next_plan_page = jp.Input(
+        a=plan_pager_div,
+        value=">",
+        type="submit",
+        classes=ADD_BUTTON_CLASS,
+        style=ADD_BUTTON_STYLE,
+    )
+    next_plan_page.on('click', gui.next_plan_click)
+    session.plan_end_p = jp.P(
+        a=plan_div,
+        classes=PLAN_PART_P_CLASS,
+        style=PLAN_PART_P_STYLE,
+    )
 
-    gui.update_planning_execution()
+    session.update_planning_execution()
 
     return wp
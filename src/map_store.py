@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Maps and fleets loaded from data files.
+#
+# A map is either a json file:
+#   {"cities": {"city_1": [1, 2, 3], "city_4": [4, 5, 6]}, "fleet": {...}}
+# where the first location of every city is its airport, or a csv file with the
+# columns `location,city` and an optional `airport` column (1 for the airport
+# of the city; without it the first location of the city is the airport).
+#
+# A fleet is either the "fleet" entry of the json map, a json file with the
+# same content, or a csv file with the columns `object,start,destination`:
+#   {"packages": {"1": [1, 4]}, "trucks": {"1": [1, 1]}, "airplanes": {"1": [1, 1]}}
+# The object names are package_<i>, truck_<i> and airplane_<i>.
+
+KINDS = ("package", "truck", "airplane")
+
+
+class FleetObject:
+    __slots__ = ("name", "kind", "number", "start", "destination")
+
+    def __init__(self, kind: str, number: int, start: int, destination: int):
+        assert kind in KINDS, f"Error: undefined object type {kind}"
+        self.name = f"{kind}_{number}"
+        self.kind = kind
+        self.number = number
+        self.start = start
+        self.destination = destination
+
+    @property
+    def label(self) -> str:
+        return f"{self.kind.capitalize()} {self.number}"
+
+
+class MapStore:
+    '''
+    A map and its default fleet, as a list of __slots__ records sorted by kind
+    and number. The questions about the map (city and airport of a location)
+    are answered by topology.TopologyIndex.
+    '''
+    def __init__(self, locations_map: Dict[str, Tuple[int, ...]], fleet: List[FleetObject]):
+        self.locations_map = locations_map
+        self.fleet = sorted(fleet, key=lambda o: (KINDS.index(o.kind), o.number))
+
+
+def fleet_from_defaults(defaults: Dict[str, Dict[int, Tuple[int, int]]]) -> List[FleetObject]:
+    fleet = []
+    for kinds, objects in defaults.items():
+        kind = kinds[:-1] if kinds.endswith("s") else kinds
+        for number, (start, dest) in objects.items():
+            fleet.append(FleetObject(kind, int(number), int(start), int(dest)))
+    return fleet
+
+
+def _read_map_csv(path: str) -> Dict[str, Tuple[int, ...]]:
+    cities: Dict[str, List[int]] = {}
+    airports: Dict[str, int] = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            city, location_id = row["city"].strip(), int(row["location"])
+            cities.setdefault(city, []).append(location_id)
+            if row.get("airport", "").strip() in ("1", "true", "True", "yes"):
+                airports[city] = location_id
+    locations_map = {}
+    for city, locations in cities.items():
+        # the airport goes first, that's how LOCATIONS_MAP marks it
+        if city in airports:
+            locations.remove(airports[city])
+            locations.insert(0, airports[city])
+        locations_map[city] = tuple(locations)
+    return locations_map
+
+
+def _read_fleet_csv(path: str) -> List[FleetObject]:
+    fleet = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            kind, number = row["object"].strip().rsplit("_", 1)
+            fleet.append(FleetObject(kind, int(number), int(row["start"]), int(row["destination"])))
+    return fleet
+
+
+def load_map_store(map_path: str, fleet_path: Optional[str] = None) -> MapStore:
+    fleet: List[FleetObject] = []
+    if os.path.splitext(map_path)[1].lower() == ".csv":
+        locations_map = _read_map_csv(map_path)
+    else:
+        with open(map_path) as f:
+            data = json.load(f)
+        locations_map = {city: tuple(map(int, l)) for city, l in data["cities"].items()}
+        fleet = fleet_from_defaults(data.get("fleet", {}))
+    if fleet_path is not None:
+        if os.path.splitext(fleet_path)[1].lower() == ".csv":
+            fleet = _read_fleet_csv(fleet_path)
+        else:
+            with open(fleet_path) as f:
+                fleet = fleet_from_defaults(json.load(f))
+    return MapStore(locations_map, fleet)
@@ -0,0 +1,216 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Counters, gauges and histograms of the planning request path and of the startup, exported in the
+# Prometheus text format by a small http server (see start_metrics_server).
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        assert len(label_values) == len(self.label_names)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, *label_values: str):
+        assert len(label_values) == len(self.label_names)
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: the count of every bucket, the total count and the sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], int, float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str):
+        assert len(label_values) == len(self.label_names)
+        with self._lock:
+            bucket_counts, count, total = self._values.get(label_values, ([0] * len(self.buckets), 0, 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            self._values[label_values] = (bucket_counts, count + 1, total + value)
+
+    def count(self, *label_values: str) -> int:
+        return self._values.get(label_values, ([], 0, 0.0))[1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (bucket_counts, count, total) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_count{labels} {count}")
+                lines.append(f"{self.name}_sum{labels} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, documentation, label_names)
+        self.metrics.append(counter)
+        return counter
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        gauge = Gauge(name, documentation, label_names)
+        self.metrics.append(gauge)
+        return gauge
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, label_names, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+REQUESTS = METRICS.counter("planning_requests_total", "Planning requests by outcome.", ("outcome",))
+STAGE_SECONDS = METRICS.histogram("planning_stage_seconds", "Time spent in every stage of a planning request.", ("stage",))
+REQUEST_SECONDS = METRICS.histogram("planning_request_seconds", "End-to-end time of a planning request, queue wait included.")
+SUBPROBLEMS = METRICS.counter("planning_subproblems_total", "Independent groups of decomposed requests by outcome.", ("outcome",))
+PLAN_ACTIONS_SAVED = METRICS.counter("planning_plan_actions_saved_total", "Actions removed from the plans by the optimizer.")
+PLAN_CONVERSIONS = METRICS.counter("planning_plan_conversions_total", "Plans of the engines converted to sequential ones, by plan kind.", ("kind",))
+
+
+# when set, every finished RequestTrace is appended to this file as a json line
+_trace_dump_file: Optional[str] = None
+_trace_dump_lock = Lock()
+
+
+def set_trace_dump_file(path: Optional[str]):
+    global _trace_dump_file
+    _trace_dump_file = path
+
+
+class RequestTrace:
+    '''
+    The timings of the stages of a single planning request; every stage is
+    also observed in STAGE_SECONDS as soon as it ends. The traces of the
+    groups of a decomposed request have the trace of the request as parent,
+    and are counted in SUBPROBLEMS instead of REQUESTS.
+    '''
+    def __init__(self, request_id: Optional[int] = None, parent: Optional["RequestTrace"] = None):
+        self.request_id = request_id
+        self.parent = parent
+        self.created_at = time.time()
+        self.stages: Dict[str, float] = {}
+        self.cache_hit = False
+        self.outcome: Optional[str] = None
+
+    def observe(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage)
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def outcome_of(self, plan) -> str:
+        if self.cache_hit:
+            return "cache_hit"
+        return "solved" if plan is not None else "no_plan"
+
+    def finish(self, outcome: str):
+        self.outcome = outcome
+        total = time.time() - self.created_at
+        if self.parent is not None:
+            SUBPROBLEMS.inc(outcome)
+        else:
+            REQUESTS.inc(outcome)
+            REQUEST_SECONDS.observe(total)
+        if _trace_dump_file is not None:
+            record = {
+                "request_id": self.request_id,
+                "parent_id": self.parent.request_id if self.parent is not None else None,
+                "created_at": self.created_at,
+                "outcome": outcome,
+                "cache_hit": self.cache_hit,
+                "total": total,
+                "stages": self.stages,
+            }
+            with _trace_dump_lock:
+                with open(_trace_dump_file, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.getLogger(__name__).info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -1,253 +1,229 @@
 import logging
-from up_graphene_engine.engine import  GrapheneEngine
-from gui import Gui, LOCATIONS_MAP
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from domain_template import LogisticDomainTemplate, get_domain_template
+from plan_cache import CachedPlan, PlanCache, cached_to_plan, plan_to_cached
+from native_solver import NativeLogisticSolver
+from metrics import PLAN_ACTIONS_SAVED, PLAN_CONVERSIONS, RequestTrace
+from optimizer import optimize_plan
+from replanning import PreviousSolve, split_for_repair
+from validation import validate_cached
 
 from unified_planning.shortcuts import *
 from unified_planning.model.htn import *
 import unified_planning as up
-import unified_planning.model.metrics
-
-get_environment().credits_stream = None
-
-
-def planning(engine: GrapheneEngine, gui: Gui, reload_page):
-    logging.info("Generating planning problem...")
-    gui.logger.info("Generating planning problem...")
-    gui.logger.info(f"with input: {gui.input_values}")
-
-    pb = HierarchicalProblem()  # make it hierarchical instead
-
-    Package = UserType("Package")
-
-    PackageLoc = UserType("PackageLoc")
-    Loc = UserType("Location", father=PackageLoc)
-    Airport = UserType("Airport", father=Loc)
-    City = UserType("City")
-
-    Vehicle = UserType("Vehicle", father=PackageLoc)
-    Truck = UserType("Truck", father=Vehicle)
-    Airplane = UserType("Airplane", father=Vehicle)
-    # city of location
-    city = pb.add_fluent("city", City, of=Loc)
-
-    # current location of package / vehicle
-    loc = pb.add_fluent("loc", PackageLoc, package=Package)
-    at = pb.add_fluent("at", Loc, vehicle=Vehicle)
-
-    load = InstantaneousAction("load", package=Package, vehicle=Vehicle, l=Loc)
-    load.add_precondition(Equals(at(load.vehicle), load.l))
-    load.add_precondition(Equals(loc(load.package), load.l))
-    load.add_effect(loc(load.package), load.vehicle)  # package now in vehicle
-    pb.add_action(load)
-
-    unload = InstantaneousAction("unload", package=Package, vehicle=Vehicle, l=Loc)
-    unload.add_precondition(Equals(at(unload.vehicle), unload.l))
-    unload.add_precondition(Equals(loc(unload.package), unload.vehicle))
-    unload.add_effect(loc(unload.package), unload.l)
-    pb.add_action(unload)
-
-    move = InstantaneousAction("move", truck=Truck, src=Loc, tgt=Loc)
-    move.add_precondition(Equals(city(move.src), city(move.tgt)))
-    move.add_precondition(Equals(at(move.truck), move.src))
-    move.add_effect(at(move.truck), move.tgt)
-    pb.add_action(move)
-
-    fly_plane = InstantaneousAction("fly-plane", plane=Airplane, src=Airport, tgt=Airport)
-    fly_plane.add_precondition(Equals(at(fly_plane.plane), fly_plane.src))
-    fly_plane.add_effect(at(fly_plane.plane), fly_plane.tgt)
-    pb.add_action(fly_plane)
-
-    # Task representing the objective of getting a given truck to a particular location
-    bring_truck = pb.add_task("bring-truck", truck=Truck, destination=Loc)
-
-    # Option 1: truck already at destination location, nothing to do
-    m = Method("bring-truck-noop", truck=Truck, dest=Loc)
-
-    # declares that m achieves the `bring-truck(truck, dest)` task`
-    m.set_task(bring_truck, m.truck, m.dest)
-
-    pb.add_method(m)
-
-    # only usable if the truck is already at the right location
-    # no subtasks, implying that if the method is usable, there is nothing left to do
-    m.add_precondition(Equals(at(m.truck), m.dest))
-
-    # Option 2: truck not at target location, move it
-    m = Method("bring-truck-move", truck=Truck, orig=Loc, dest=Loc)
-    # declares that m achieves the `bring-truck(truck, to)` task`
-    m.set_task(bring_truck, m.truck, m.dest)
-
-    m.add_precondition(Equals(at(m.truck), m.orig))      # restrict applicability to cases where the truck is
-    m.add_precondition(Not(Equals(m.orig, m.dest)))        # in a different location
-    m.add_precondition(Equals(city(m.orig), city(m.dest))) # of the same city
-
-    # accomplishing this method requires executing a `move` action
-    m.add_subtask(move, m.truck, m.orig, m.dest, ident="move-subtask")
-
-    pb.add_method(m)
-
-    # Task for transporting a given package to a given location,
-    # This method assumes that the package is already in the right city
-    transport_in_city = pb.add_task("transport-in-city", package=Package, destination=Loc)
-
-    # Method 1: handling the case where the package is already at the destination
-    m = Method("transport-in-city-noop", package=Package, to=Loc)
-    m.set_task(transport_in_city, m.package, m.to)  # set the task that this method achieve
-    m.add_precondition(Equals(loc(m.package), m.to))  # only allow using this method if the package is already at the destination
-    # note: no subtasks are added => nothing to do in this method
-    pb.add_method(m)
-
-    m = Method("transport-in-city-truck", package=Package, orig=Loc, to=Loc, truck=Truck)
-    m.set_task(transport_in_city, m.package, m.to)
-    m.add_precondition(Equals(loc(m.package), m.orig)) # package is at origin
-    m.add_precondition(Not(Equals(m.orig, m.to)))
-    m.add_precondition(Equals(city(m.orig), city(m.to)))  # destination is the same city
-
-    # this method decomposed into a sequence of 4 subtasks (mixing the load/unload action and the 'bring-truck' task)
-    t1 = m.add_subtask(bring_truck, m.truck, m.orig)  # bring truck to package location
-    t2 = m.add_subtask(load, m.package, m.truck, m.orig)  # load package in truck
-    t3 = m.add_subtask(bring_truck, m.truck, m.to)  # bring truck to target location
-    t4 = m.add_subtask(unload, m.package, m.truck, m.to)  # unload package at target location
-    m.set_ordered(t1, t2, t3, t4)  # enforce all 4 subtasks to be done in this order
-    pb.add_method(m)
-
-    # bring airplane subtask
-    # Task representing the objective of getting a given airplane to a particular location
-    bring_airplane = pb.add_task("bring-airplane", airplane=Airplane, destination=Airport)
-
-    # Option 1: truck already at destination location, nothing to do
-    m = Method("bring-airplane-noop", airplane=Airplane, dest=Airport)
-
-    # declares that m achieves the `bring-truck(truck, dest)` task`
-    m.set_task(bring_airplane, m.airplane, m.dest)
-
-    # only usable if the airplane is already at the right airport
-    # no subtasks, implying that if the method is usable, there is nothing left to do
-    m.add_precondition(Equals(at(m.airplane), m.dest))
-
-    pb.add_method(m)
-
-    # Option 2: airplane not at target airport, move it
-    m = Method("bring-airplane-fly", airplane=Airplane, orig=Airport, dest=Airport)
-    # declares that m achieves the `bring-airplane(airplane, to)` task`
-    m.set_task(bring_airplane, m.airplane, m.dest)
-
-    m.add_precondition(Equals(at(m.airplane), m.orig))      # restrict applicability to cases where the airplane is
-    m.add_precondition(Not(Equals(m.orig, m.dest)))        # in a different location
-
-    # accomplishing this method requires executing a `move` action
-    m.add_subtask(fly_plane, m.airplane, m.orig, m.dest, ident="fly-subtask")
-
-    pb.add_method(m)
-
-    # Task for transporting a given package to a given Airport,
-    transport_outside_city = pb.add_task("transport-outside-city", package=Package, destination=Airport)
-
-    # Method 1: handling the case where the package is already at the destination
-    m = Method("transport-outside-city-noop", package=Package, to=Airport)
-    m.set_task(transport_outside_city, m.package, m.to)  # set the task that this method achieve
-    m.add_precondition(Equals(loc(m.package), m.to))  # only allow using this method if the package is already at the destination
-    # note: no subtasks are added => nothing to do in this method
-    pb.add_method(m)
-
-    m = Method("transport-outside-city-airplane", package=Package, orig=Airport, to=Airport, airplane=Airplane)
-    m.set_task(transport_outside_city, m.package, m.to)
-    m.add_precondition(Equals(loc(m.package), m.orig)) # package is at origin
-    m.add_precondition(Not(Equals(m.orig, m.to)))
-
-    # this method decomposed into a sequence of 4 subtasks (mixing the load/unload action and the 'fly-airplane' task)
-    t1 = m.add_subtask(bring_airplane, m.airplane, m.orig)  # bring airplane to package location
-    t2 = m.add_subtask(load, m.package, m.airplane, m.orig)  # load package in airplane
-    t3 = m.add_subtask(bring_airplane, m.airplane, m.to)  # bring airplane to target location
-    t4 = m.add_subtask(unload, m.package, m.airplane, m.to)  # unload package at target location
-    m.set_ordered(t1, t2, t3, t4)  # enforce all 4 subtasks to be done in this order
-    pb.add_method(m)
-
-    # Task for transporting a given package to a given Loc,
-    transport_package = pb.add_task("transport-package", package=Package, destination=Loc)
-
-    m = Method("transport-package-noop", package=Package, to=Loc)
-    m.set_task(transport_package, m.package, m.to)
-    m.add_precondition(Equals(loc(m.package), m.to)) # package is at origin
-    pb.add_method(m)
-
-    m = Method("transport-package-truck", package=Package, orig=Loc, to=Loc, truck=Truck)
-    m.set_task(transport_package, m.package, m.to)
-    t1 = m.add_subtask(transport_in_city, m.package, m.to)
-    pb.add_method(m)
-
-    m = Method("transport-package-airplane", package=Package, to=Loc, intermediate=Airport)
-    m.set_task(transport_package, m.package, m.to)
-    m.add_precondition(Equals(city(m.intermediate), city(m.to)))
-    t1 = m.add_subtask(transport_outside_city, m.package, m.intermediate)
-    t2 = m.add_subtask(transport_in_city, m.package, m.to)
-    m.set_ordered(t1, t2)
-    pb.add_method(m)
-
-    m = Method("transport-package-truck-airplane", package=Package, orig=Loc, to=Loc, orig_airport=Airport, to_airport=Airport)
-    m.set_task(transport_package, m.package, m.to)
-    m.add_precondition(Equals(city(m.orig), city(m.orig_airport)))
-    m.add_precondition(Equals(city(m.to_airport), city(m.to)))
-    t1 = m.add_subtask(transport_in_city, m.package, m.orig_airport)
-    t2 = m.add_subtask(transport_outside_city, m.package, m.to_airport)
-    t3 = m.add_subtask(transport_in_city, m.package, m.to)
-    m.set_ordered(t1, t2, t3)
-    pb.add_method(m)
-
-    locations_id_mapping: Dict[int, Object] = {}
-    for city_name, locations in LOCATIONS_MAP.items():
-        if not locations:
-            continue
-        city_object = pb.add_object(city_name, City)
-        airport_id = locations[0]
-        airport_name = f"airport_{airport_id}"
-        airport_object = pb.add_object(airport_name, Airport)
-        pb.set_initial_value(city(airport_object), city_object)
-        assert airport_id not in locations_id_mapping
-        locations_id_mapping[airport_id] = airport_object
-        for location_id in locations[1:]:
-            location_name = f"location_{location_id}"
-            location_object = pb.add_object(location_name, Loc)
-            pb.set_initial_value(city(location_object), city_object)
-            assert location_id not in locations_id_mapping
-            locations_id_mapping[location_id] = location_object
-    object_type_map = {
-        "package": Package,
-        "truck": Truck,
-        "airplane": Airplane,
-    }
-    # for object_name, start_dest_ids in default.items():
-    for object_name, start_dest_ids in gui.input_values.items():
-        start, dest = map(locations_id_mapping.get, start_dest_ids)
-        object_type = object_type_map.get(object_name.split("_")[0], None)
-        assert object_type is not None, f"Error: undefined object type for {object_name}"
-        obj = pb.add_object(object_name, object_type)
-        if object_type == Package:
-            pb.set_initial_value(loc(obj), start)
-            pb.task_network.add_subtask(transport_package, obj, dest)
-            pb.add_goal(Equals(loc(obj), dest))
-        else:
-            pb.set_initial_value(at(obj), start)
-            pb.add_goal(Equals(at(obj), dest))
-            if obj.type == Truck:
-                pb.task_network.add_subtask(bring_truck, obj, dest)
-            if obj.type == Airplane:
-                pb.task_network.add_subtask(bring_airplane, obj, dest)
-
-    logging.info("Planning...")
-    gui.logger.info("Planning...")
-
-    res = engine.solve(pb)
+from unified_planning.engines.results import PlanGenerationResultStatus
+from unified_planning.plans.hierarchical_plan import Decomposition
+
+if TYPE_CHECKING:
+    from up_graphene_engine.engine import GrapheneEngine
+    from decomposition import ProblemDecomposer
+
+
+# the tasks of a hierarchical plan: (task id, method or action name, parameter
+# names, subtasks), the actions have no subtasks
+DecompositionTree = List[Tuple[str, str, Tuple[str, ...], "DecompositionTree"]]
+
+
+def convert_plan(plan: Optional[up.plans.Plan], pb: Problem) -> Optional[up.plans.SequentialPlan]:
+    if plan is None:
+        return None
+    kind = plan.kind
+    PLAN_CONVERSIONS.inc(kind.name)
+    if kind == PlanKind.HIERARCHICAL_PLAN:
+        # the flat plan is already computed, the decomposition is not needed
+        plan = plan.action_plan
+        kind = plan.kind
+    if kind == PlanKind.SEQUENTIAL_PLAN:
+        return plan
+    if kind == PlanKind.TIME_TRIGGERED_PLAN:
+        # our actions are instantaneous, their order is the order of their start
+        timed_actions = sorted(plan.timed_actions, key=lambda timed_action: timed_action[0])
+        return up.plans.SequentialPlan([a for _, a, _ in timed_actions], plan.environment)
+    return plan.convert_to(PlanKind.SEQUENTIAL_PLAN, pb)
+
+
+def decomposition_tree(plan: Optional[up.plans.Plan]) -> Optional[DecompositionTree]:
+    # None for the plans without hierarchy
+    if plan is None or plan.kind != PlanKind.HIERARCHICAL_PLAN:
+        return None
+
+    def tree(decomposition: Decomposition) -> DecompositionTree:
+        nodes = []
+        for task_id, instance in decomposition.subtasks.items():
+            if isinstance(instance, up.plans.ActionInstance):
+                nodes.append((task_id, instance.action.name, tuple(str(p) for p in instance.actual_parameters), []))
+            else:
+                nodes.append((task_id, instance.method.name, tuple(str(p) for p in instance.parameters), tree(instance.decomposition)))
+        return nodes
+
+    return tree(plan.decomposition)
+
+
+def optimized_plan(
+    plan: CachedPlan,
+    input_values: Dict[str, Tuple[int, int]],
+    pb: HierarchicalProblem,
+    trace: RequestTrace,
+    logger: logging.Logger,
+) -> Optional[up.plans.SequentialPlan]:
+    # the plan shortened by the optimizer, None when it can't be shortened
+    with trace.stage("optimize"):
+        optimized = optimize_plan(plan)
+        if len(optimized) == len(plan):
+            return None
+        valid = validate_cached(input_values, optimized)
+        if not valid:
+            logger.warning(f"Optimized plan is not valid ({valid.error}), keeping the original one")
+            return None
+        result = cached_to_plan(optimized, pb)
+    logger.info(f"Optimized plan: {len(plan)} -> {len(optimized)} actions")
+    PLAN_ACTIONS_SAVED.inc(amount=len(plan) - len(optimized))
+    return result
+
+
+def planning(
+    engine: "GrapheneEngine",
+    input_values: Dict[str, Tuple[int, int]],
+    logger: Optional[logging.Logger] = None,
+    plan_cache: Optional[PlanCache] = None,
+    domain_template: Optional[LogisticDomainTemplate] = None,
+    trace: Optional[RequestTrace] = None,
+    native_solver: Optional[NativeLogisticSolver] = None,
+    decomposer: Optional["ProblemDecomposer"] = None,
+    previous: Optional[PreviousSolve] = None,
+    optimize: bool = False,
+    on_decomposition: Optional[Callable[[DecompositionTree], None]] = None,
+):
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    if domain_template is None:
+        domain_template = get_domain_template()
+    # without a trace given by the caller, the request is traced and finished here
+    own_trace = trace is None
+    if trace is None:
+        trace = RequestTrace()
+    logger.info("Generating planning problem...")
+    logger.info(f"with input: {input_values}")
+
+    with trace.stage("build"):
+        pb = domain_template.instantiate(input_values)
+
+    if plan_cache is not None:
+        with trace.stage("cache_lookup"):
+            found, plan = plan_cache.get(input_values, pb)
+        if found:
+            logger.info(f"Plan found in cache... {plan_cache.stats()}")
+            trace.cache_hit = True
+            if own_trace:
+                trace.finish(trace.outcome_of(plan))
+            return plan
+
+    # fast path: solve in-process, the engine is only used when the native solver gives up
+    if native_solver is not None:
+        with trace.stage("native_solve"):
+            native_plan = native_solver.solve(input_values)
+        if native_plan is not None:
+            plan = optimized_plan(native_plan, input_values, pb, trace, logger) if optimize else None
+            if plan is None:
+                plan = cached_to_plan(native_plan, pb)
+            logger.info("Plan found by the native solver...")
+            if own_trace:
+                trace.finish(trace.outcome_of(plan))
+            return plan
+
+    # an edited instance: only the objects affected by the edit are solved again
+    if previous is not None:
+        plan = repair(
+            engine, input_values, pb, previous, logger, plan_cache, domain_template, trace,
+            native_solver, decomposer, optimize,
+        )
+        if plan is not None:
+            logger.info("Plan repaired from the previous one...")
+            if plan_cache is not None:
+                plan_cache.put(input_values, plan)
+            if own_trace:
+                trace.finish(trace.outcome_of(plan))
+            return plan
+
+    # big instances: independent groups of objects solved concurrently
+    if decomposer is not None:
+        plan = decomposer.solve(input_values, pb, trace, engine)
+        if plan is not None:
+            logger.info("Plan merged from the independent groups...")
+            if plan_cache is not None:
+                plan_cache.put(input_values, plan)
+            if own_trace:
+                trace.finish(trace.outcome_of(plan))
+            return plan
+
+    logger.info("Planning...")
+
+    with trace.stage("solve"):
+        res = engine.solve(pb)
     plan = res.plan
-    gui.logger.info("Received result...")
-
-    if plan is not None:
-        try:
-            plan = plan.convert_to(PlanKind.SEQUENTIAL_PLAN, pb)
-        except Exception as e:
-            tt_plan = plan.convert_to(PlanKind.TIME_TRIGGERED_PLAN, pb)
-            plan = up.plans.SequentialPlan([a for _, a, _ in tt_plan.timed_actions])
-    gui.logger.info("Returning plan..")
-    gui.logger.info(str(plan))
-    gui.logger.info(str(res))
+    logger.info(f"Received result: {res.status.name}")
+
+    with trace.stage("convert"):
+        if on_decomposition is not None:
+            tree = decomposition_tree(plan)
+            if tree is not None:
+                on_decomposition(tree)
+        plan = convert_plan(plan, pb)
+    # a missing plan is only definitive when the planner proved there's none,
+    # not for incomplete planners or unsupported problems
+    definitive = plan is not None or res.status == PlanGenerationResultStatus.UNSOLVABLE_PROVEN
+    if optimize and plan is not None:
+        plan = optimized_plan(plan_to_cached(plan), input_values, pb, trace, logger) or plan
+    # only store definitive results, errors and timeouts must be retried
+    if plan_cache is not None and definitive:
+        plan_cache.put(input_values, plan)
+    logger.info(f"Returning plan of {len(plan.actions)} actions" if plan is not None else "Returning no plan")
+    # the whole plan is only written when debugging, it can be huge
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(str(plan))
+    if own_trace:
+        trace.finish(trace.outcome_of(plan))
     return plan
+
+
+def repair(
+    engine: "GrapheneEngine",
+    input_values: Dict[str, Tuple[int, int]],
+    pb: HierarchicalProblem,
+    previous: PreviousSolve,
+    logger: logging.Logger,
+    plan_cache: Optional[PlanCache],
+    domain_template: LogisticDomainTemplate,
+    trace: RequestTrace,
+    native_solver: Optional[NativeLogisticSolver],
+    decomposer: Optional["ProblemDecomposer"],
+    optimize: bool,
+) -> Optional[up.plans.SequentialPlan]:
+    # None when the previous plan can't be reused, the caller then solves the whole problem
+    with trace.stage("repair_split"):
+        split = split_for_repair(previous, input_values)
+    if split is None:
+        return None
+    kept_plan, remaining = split
+    logger.info(f"Keeping {len(kept_plan)} actions, solving {len(remaining)} objects again...")
+    repair_plan = []
+    if remaining:
+        sub_trace = RequestTrace(trace.request_id, parent=trace)
+        sub_plan = planning(
+            engine, remaining, logger, plan_cache, domain_template, sub_trace,
+            native_solver=native_solver, decomposer=decomposer, optimize=optimize,
+        )
+        sub_trace.finish(sub_trace.outcome_of(sub_plan))
+        if sub_plan is None:
+            # e.g. the only truck of a city is in a kept component
+            logger.info("Repair failed, solving the whole problem")
+            return None
+        repair_plan = plan_to_cached(sub_plan)
+    # the kept actions don't touch the objects of the repair, their order is free
+    plan = kept_plan + repair_plan
+    with trace.stage("repair_validate"):
+        valid = validate_cached(input_values, plan)
+    if not valid:
+        logger.warning(f"Repaired plan is not valid ({valid.error}), solving the whole problem")
+        return None
+    return cached_to_plan(plan, pb)
@@ -0,0 +1,125 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+from logistic_map import LOCATIONS_MAP
+from plan_cache import CachedPlan
+
+
+class NativeLogisticSolver:
+    '''
+    In-process solver of the logistic instances, following the decomposition
+    of the HTN domain instead of searching: every package is moved by the
+    transport-package methods (in-city with a truck, outside-city with an
+    airplane, or truck-airplane-truck), then the vehicles are brought to their
+    destination by bring-truck/bring-airplane.
+
+    It returns None whenever it can't solve the instance (too big, no truck in
+    a city, no airplane, ...); in that case the caller falls back to a real
+    planner, which gives the definitive answer.
+    '''
+    def __init__(self, locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP, max_objects: int = 1000):
+        self.max_objects = max_objects
+        self.city_of: Dict[int, str] = {}
+        self.airport_of: Dict[str, int] = {}
+        self.location_names: Dict[int, str] = {}
+        self.airports: Set[int] = set()
+        for city_name, locations in locations_map.items():
+            if not locations:
+                continue
+            self.airport_of[city_name] = locations[0]
+            self.airports.add(locations[0])
+            self.location_names[locations[0]] = f"airport_{locations[0]}"
+            for location_id in locations:
+                self.city_of[location_id] = city_name
+            for location_id in locations[1:]:
+                self.location_names[location_id] = f"location_{location_id}"
+
+    def fits(self, input_values: Dict[str, Tuple[int, int]]) -> bool:
+        if len(input_values) > self.max_objects:
+            return False
+        for object_name, (start, dest) in input_values.items():
+            if start not in self.city_of or dest not in self.city_of:
+                return False
+            if object_name.startswith("airplane_"):
+                if start not in self.airports or dest not in self.airports:
+                    return False
+        return True
+
+    def solve(self, input_values: Dict[str, Tuple[int, int]]) -> Optional[CachedPlan]:
+        if not self.fits(input_values):
+            return None
+        packages: List[Tuple[str, int, int]] = []
+        at: Dict[str, int] = {}
+        trucks: List[str] = []
+        airplanes: List[str] = []
+        for object_name, (start, dest) in input_values.items():
+            kind = object_name.split("_")[0]
+            if kind == "package":
+                packages.append((object_name, start, dest))
+            elif kind == "truck":
+                trucks.append(object_name)
+                at[object_name] = start
+            elif kind == "airplane":
+                airplanes.append(object_name)
+                at[object_name] = start
+            else:
+                return None
+
+        plan: List[Tuple[str, Tuple[str, ...]]] = []
+        names = self.location_names
+
+        def pick(vehicles: List[str], city: Optional[str], location: int) -> Optional[str]:
+            # a vehicle already at the location saves a move
+            candidates = [v for v in vehicles if city is None or self.city_of[at[v]] == city]
+            for v in candidates:
+                if at[v] == location:
+                    return v
+            return candidates[0] if candidates else None
+
+        def bring(vehicle: str, target: int):
+            # bring-truck / bring-airplane: noop or a single move
+            if at[vehicle] == target:
+                return
+            action = "fly-plane" if vehicle.startswith("airplane_") else "move"
+            plan.append((action, (vehicle, names[at[vehicle]], names[target])))
+            at[vehicle] = target
+
+        def carry(package: str, vehicle: str, orig: int, to: int):
+            # transport-in-city-truck / transport-outside-city-airplane
+            bring(vehicle, orig)
+            plan.append(("load", (package, vehicle, names[orig])))
+            bring(vehicle, to)
+            plan.append(("unload", (package, vehicle, names[to])))
+
+        def in_city(package: str, orig: int, to: int) -> bool:
+            if orig == to:
+                return True
+            truck = pick(trucks, self.city_of[orig], orig)
+            if truck is None:
+                return False
+            carry(package, truck, orig, to)
+            return True
+
+        for package, start, dest in packages:
+            if start == dest:
+                continue
+            start_city, dest_city = self.city_of[start], self.city_of[dest]
+            if start_city == dest_city:
+                if not in_city(package, start, dest):
+                    return None
+                continue
+            orig_airport, to_airport = self.airport_of[start_city], self.airport_of[dest_city]
+            if not in_city(package, start, orig_airport):
+                return None
+            airplane = pick(airplanes, None, orig_airport)
+            if airplane is None:
+                return None
+            carry(package, airplane, orig_airport, to_airport)
+            if not in_city(package, to_airport, dest):
+                return None
+
+        for vehicle in trucks + airplanes:
+            _, dest = input_values[vehicle]
+            if vehicle.startswith("truck_") and self.city_of[at[vehicle]] != self.city_of[dest]:
+                return None
+            bring(vehicle, dest)
+        return plan
@@ -0,0 +1,100 @@
+from typing import Dict, List, Tuple
+
+from plan_cache import CachedPlan
+
+# Local optimization of the plans returned by the planner, where every action
+# costs the same:
+#  - loads and unloads are done at the earliest visit of the vehicle to their
+#    location that the package allows, so several packages share a trip;
+#  - a chain of moves (or flights) of a vehicle that loads and unloads nothing
+#    in between becomes a single move to the last location, or nothing when
+#    the vehicle gets back where it was.
+# Packages and vehicles interact only through load and unload, so the plan
+# stays valid as long as every object sees its own actions in the same order
+# and a vehicle is where its loads and unloads happen.
+
+MOVES = ("move", "fly-plane")
+
+# position of an action in the optimized plan: actions keep (index, 0), an
+# action done right after the one at index gets (index, n) with n > 0
+Key = Tuple[int, int]
+
+
+def _visits(plan: CachedPlan) -> Dict[str, List[Tuple[Key, str, Key]]]:
+    # vehicle -> [(arrival, location, departure)], from its moves
+    visits: Dict[str, List[Tuple[Key, str, Key]]] = {}
+    end = (len(plan), 0)
+    for i, (action_name, params) in enumerate(plan):
+        if action_name in MOVES:
+            vehicle, src, tgt = params
+            vehicle_visits = visits.setdefault(vehicle, [((-1, 0), src, end)])
+            arrival, location, _ = vehicle_visits[-1]
+            vehicle_visits[-1] = (arrival, location, (i, 0))
+            vehicle_visits.append(((i, 0), tgt, end))
+    return visits
+
+
+def _share_trips(plan: CachedPlan) -> CachedPlan:
+    visits = _visits(plan)
+    keys: List[Key] = [(i, 0) for i in range(len(plan))]
+    last_of_package: Dict[str, Key] = {}
+    counter = 0
+    for i, (action_name, params) in enumerate(plan):
+        if action_name in MOVES:
+            continue
+        package, vehicle, location = params
+        after = last_of_package.get(package, (-1, 0))
+        # the first visit of the vehicle to the location, after the previous
+        # action of the package, that's still going on
+        for arrival, visit_location, departure in visits.get(vehicle, []):
+            if arrival >= keys[i]:
+                break
+            if visit_location == location and max(arrival, after) < departure:
+                counter += 1
+                keys[i] = (max(arrival, after)[0], counter)
+                break
+        last_of_package[package] = keys[i]
+    order = sorted(range(len(plan)), key=keys.__getitem__)
+    return [plan[i] for i in order]
+
+
+def _merge_moves(plan: CachedPlan) -> CachedPlan:
+    removed = set()
+    # vehicle -> (index of the last move of its current chain, start of the chain)
+    chains: Dict[str, Tuple[int, str]] = {}
+    replaced: Dict[int, Tuple[str, Tuple[str, ...]]] = {}
+
+    def close(vehicle: str):
+        index, start = chains.pop(vehicle)
+        action_name, (_, _, tgt) = plan[index]
+        if start == tgt:
+            removed.add(index)
+        else:
+            replaced[index] = (action_name, (vehicle, start, tgt))
+
+    for i, (action_name, params) in enumerate(plan):
+        if action_name in MOVES:
+            vehicle, src, _ = params
+            if vehicle in chains:
+                previous, start = chains[vehicle]
+                removed.add(previous)
+                chains[vehicle] = (i, start)
+            else:
+                chains[vehicle] = (i, src)
+        else:
+            vehicle = params[1]
+            if vehicle in chains:
+                close(vehicle)
+    for vehicle in list(chains):
+        close(vehicle)
+    return [replaced.get(i, action) for i, action in enumerate(plan) if i not in removed]
+
+
+def optimize_plan(plan: CachedPlan, rounds: int = 3) -> CachedPlan:
+    # merged moves can make new trips shareable, so a few rounds are done
+    for _ in range(rounds):
+        optimized = _merge_moves(_share_trips(plan))
+        if len(optimized) >= len(plan):
+            break
+        plan = optimized
+    return plan
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from threading import Lock
+from typing import Any, Callable, Dict, List
+
+import justpy as jp
+
+from metrics import METRICS
+
+PAGE_UPDATES = METRICS.counter("gui_page_updates_total", "Component updates pushed to the pages.")
+PAGE_UPDATES_DROPPED = METRICS.counter("gui_page_updates_dropped_total", "Updates published to topics without any connected page.")
+
+
+def call_in_loop(function: Callable[..., Any], *args) -> bool:
+    '''
+    Calls `function(*args)` from the event loop of justpy, which renders the
+    pages and handles their events: the components must only be changed there.
+    Without a running justpy (e.g. headless) it is called right away. False
+    when it is only scheduled.
+    '''
+    loop = getattr(jp.WebPage, "loop", None)
+    if loop is None or loop.is_closed():
+        function(*args)
+        return True
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        function(*args)
+        return True
+    loop.call_soon_threadsafe(function, *args)
+    return False
+
+
+class PageUpdates:
+    '''
+    Publish/subscribe of component updates: pages subscribe to a topic (e.g.
+    the session they show), and publish() pushes only the given components to
+    the websockets of the pages subscribed to the topic, instead of reloading
+    every page. The updates are sent by the event loop of justpy, whatever the
+    thread publishing them (e.g. a planning worker).
+    '''
+    def __init__(self):
+        self._subscribers: Dict[str, Dict[int, jp.WebPage]] = {}
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def subscribe(self, topic: str, page: jp.WebPage):
+        with self._lock:
+            self._subscribers.setdefault(topic, {})[page.page_id] = page
+
+    def unsubscribe(self, topic: str, page: jp.WebPage):
+        with self._lock:
+            pages = self._subscribers.get(topic, None)
+            if pages is not None:
+                pages.pop(page.page_id, None)
+                if not pages:
+                    del self._subscribers[topic]
+
+    def subscribers(self, topic: str) -> List[jp.WebPage]:
+        with self._lock:
+            return list(self._subscribers.get(topic, {}).values())
+
+    def publish(self, topic: str, *components) -> bool:
+        # False when nothing is sent: no page subscribed, or justpy not started
+        pages = self.subscribers(topic)
+        loop = getattr(jp.WebPage, "loop", None)
+        if not pages or loop is None or loop.is_closed():
+            PAGE_UPDATES_DROPPED.inc()
+            return False
+        coroutine = self._send(pages, components)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            loop.create_task(coroutine)
+        else:
+            asyncio.run_coroutine_threadsafe(coroutine, loop)
+        return True
+
+    async def _send(self, pages: List[jp.WebPage], components):
+        for page in pages:
+            websockets = list(jp.WebPage.sockets.get(page.page_id, {}).values())
+            for websocket in websockets:
+                for component in components:
+                    try:
+                        await component.update(websocket)
+                    except Exception as e:
+                        # e.g. the page has just been closed
+                        self.logger.info(f"Update of page {page.page_id} failed: {e}")
+                        break
+                    PAGE_UPDATES.inc()
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from threading import Lock, get_ident
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from logistic_map import LOCATIONS_MAP
+from canonical import canonicalize, invert_renaming
+from wire_format import decode_plan, encode_plan
+
+if TYPE_CHECKING:
+    import unified_planning as up
+    from unified_planning.model import Problem
+
+# a plan stored in the cache: a sequence of (action name, parameter names), or
+# None when the planner proved that the instance has no plan
+CachedPlan = Optional[List[Tuple[str, Tuple[str, ...]]]]
+
+
+def map_version(locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP) -> str:
+    encoded = json.dumps(sorted((c, list(l)) for c, l in locations_map.items()))
+    return hashlib.sha1(encoded.encode()).hexdigest()[:12]
+
+
+MAP_VERSION = map_version()
+
+
+def fingerprint(input_values: Dict[str, Tuple[int, int]], version: str = MAP_VERSION) -> str:
+    items = sorted((name, int(start), int(dest)) for name, (start, dest) in input_values.items())
+    encoded = json.dumps([version, items])
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def plan_to_cached(plan: Optional["up.plans.SequentialPlan"]) -> CachedPlan:
+    if plan is None:
+        return None
+    return [
+        (ai.action.name, tuple(str(p) for p in ai.actual_parameters))
+        for ai in plan.actions
+    ]
+
+
+def rename_cached(cached: CachedPlan, renaming: Dict[str, str]) -> CachedPlan:
+    if cached is None:
+        return None
+    return [
+        (name, tuple(renaming.get(p, p) for p in params))
+        for name, params in cached
+    ]
+
+
+def cached_to_plan(cached: CachedPlan, pb: "Problem") -> Optional["up.plans.SequentialPlan"]:
+    if cached is None:
+        return None
+    from unified_planning.plans import ActionInstance, SequentialPlan
+
+    # Problem.object and Problem.action are linear scans, look the names up once
+    objects = {o.name: o for o in pb.all_objects}
+    actions = {a.name: a for a in pb.actions}
+    return SequentialPlan([
+        ActionInstance(actions[name], tuple(objects[p] for p in params))
+        for name, params in cached
+    ])
+
+
+class PlanCache:
+    '''
+    LRU cache of solved logistic instances, keyed by the fingerprint of the
+    input values and of the map; entries older than `ttl` seconds are expired.
+    When `persistent_dir` is given, every entry is also written there as a file
+    and read back when it's not in memory (e.g. after a restart).
+    With `symmetry`, instances are stored in their canonical form (see
+    canonical.py), so renamed-but-equivalent instances share the same entry.
+    The files are read and written outside of the lock, and a plan that can't
+    be written is only kept in memory.
+    '''
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = None, persistent_dir: Optional[str] = None, symmetry: bool = True):
+        assert max_size > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent_dir = persistent_dir
+        self.symmetry = symmetry
+        if persistent_dir is not None:
+            os.makedirs(persistent_dir, exist_ok=True)
+        self._entries: "OrderedDict[str, Tuple[float, CachedPlan]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.logger = logging.getLogger(__name__)
+
+    def _expired(self, timestamp: float) -> bool:
+        return self.ttl is not None and time.time() - timestamp > self.ttl
+
+    def _disk_path(self, key: str, extension: str = "plan") -> str:
+        assert self.persistent_dir is not None
+        return os.path.join(self.persistent_dir, f"{key}.{extension}")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, CachedPlan]]:
+        # the plans are stored in the compact format (see wire_format.py), the
+        # json files are the ones written before it, or of plans it can't encode
+        if self.persistent_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                data = f.read()
+            return os.path.getmtime(self._disk_path(key)), decode_plan(data)
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self._disk_path(key, "json")) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        plan = data["plan"]
+        if plan is not None:
+            plan = [(name, tuple(params)) for name, params in plan]
+        return data["timestamp"], plan
+
+    def _write_disk(self, key: str, timestamp: float, plan: CachedPlan):
+        if self.persistent_dir is None:
+            return
+        try:
+            path, data = self._disk_path(key), encode_plan(plan)
+        except ValueError:
+            path, data = self._disk_path(key, "json"), json.dumps({"timestamp": timestamp, "plan": plan}).encode()
+        # every thread writes its own file, the last replace wins
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # the timestamp of the binary entries is the time of the file
+            os.utime(tmp_path, (timestamp, timestamp))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning(f"Can't write the cached plan {key} to {self.persistent_dir}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _insert(self, key: str, entry: Tuple[float, CachedPlan]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def lookup(self, key: str) -> Tuple[bool, CachedPlan]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+        entry = self._read_disk(key)
+        if entry is not None and self._expired(entry[0]):
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.disk_hits += 1
+            self.hits += 1
+            # unless stored meanwhile
+            if key not in self._entries:
+                self._insert(key, entry)
+            return True, entry[1]
+
+    def store(self, key: str, plan: CachedPlan):
+        entry = (time.time(), plan)
+        with self._lock:
+            self._insert(key, entry)
+        self._write_disk(key, *entry)
+
+    def _key(self, input_values: Dict[str, Tuple[int, int]]) -> Tuple[str, Dict[str, str]]:
+        if not self.symmetry:
+            return fingerprint(input_values), {}
+        canonical_values, renaming = canonicalize(input_values)
+        return fingerprint(canonical_values), renaming
+
+    def get(self, input_values: Dict[str, Tuple[int, int]], pb: "Problem") -> Tuple[bool, Optional["up.plans.SequentialPlan"]]:
+        key, renaming = self._key(input_values)
+        found, cached = self.lookup(key)
+        if not found:
+            return False, None
+        # the stored plan uses the canonical names, bring it back to the given ones
+        return True, cached_to_plan(rename_cached(cached, invert_renaming(renaming)), pb)
+
+    def put(self, input_values: Dict[str, Tuple[int, int]], plan: Optional["up.plans.SequentialPlan"]):
+        key, renaming = self._key(input_values)
+        self.store(key, rename_cached(plan_to_cached(plan), renaming))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+            }
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from engine_client import AsyncEngineClient, LoopService
+from metrics import METRICS
+from modified_planning import convert_plan
+from validation import validate_plan
+
+import unified_planning as up
+from unified_planning.shortcuts import *
+from unified_planning.model.htn import *
+from unified_planning.engines.results import PlanGenerationResult, PlanGenerationResultStatus, POSITIVE_OUTCOMES
+
+PORTFOLIO_WINS = METRICS.counter("planning_portfolio_wins_total", "Plans returned by every member of the portfolio.", ("member",))
+PORTFOLIO_INVALID = METRICS.counter("planning_portfolio_invalid_plans_total", "Plans of the portfolio members rejected by the validator.", ("member",))
+
+
+class ClassicalEncoding:
+    '''
+    Classical encoding of the logistic problems: the task network is dropped
+    (the goals of the problem are the same) and the object fluents become
+    boolean ones, as most classical planners require. The actions keep names
+    and parameters, so a plan of the encoding maps back one to one. (The
+    up_usertype_fluents_remover compiler can't handle our type hierarchy, the
+    package location is a PackageLoc compared with vehicles and airports.)
+    '''
+    def __init__(self, pb: HierarchicalProblem):
+        types = {t.name: t for t in pb.user_types}
+        Package, PackageLoc, Loc = types["Package"], types["PackageLoc"], types["Location"]
+        Vehicle, Truck, Airplane, Airport = types["Vehicle"], types["Truck"], types["Airplane"], types["Airport"]
+        self.loc = loc = Fluent("loc", BoolType(), package=Package, l=PackageLoc)
+        self.at = at = Fluent("at", BoolType(), vehicle=Vehicle, l=Loc)
+        self.same_city = same_city = Fluent("same_city", BoolType(), l1=Loc, l2=Loc)
+
+        load = InstantaneousAction("load", package=Package, vehicle=Vehicle, l=Loc)
+        load.add_precondition(at(load.vehicle, load.l))
+        load.add_precondition(loc(load.package, load.l))
+        load.add_effect(loc(load.package, load.l), False)
+        load.add_effect(loc(load.package, load.vehicle), True)
+
+        unload = InstantaneousAction("unload", package=Package, vehicle=Vehicle, l=Loc)
+        unload.add_precondition(at(unload.vehicle, unload.l))
+        unload.add_precondition(loc(unload.package, unload.vehicle))
+        unload.add_effect(loc(unload.package, unload.vehicle), False)
+        unload.add_effect(loc(unload.package, unload.l), True)
+
+        move = InstantaneousAction("move", truck=Truck, src=Loc, tgt=Loc)
+        move.add_precondition(same_city(move.src, move.tgt))
+        move.add_precondition(Not(Equals(move.src, move.tgt)))
+        move.add_precondition(at(move.truck, move.src))
+        move.add_effect(at(move.truck, move.src), False)
+        move.add_effect(at(move.truck, move.tgt), True)
+
+        fly_plane = InstantaneousAction("fly-plane", plane=Airplane, src=Airport, tgt=Airport)
+        fly_plane.add_precondition(Not(Equals(fly_plane.src, fly_plane.tgt)))
+        fly_plane.add_precondition(at(fly_plane.plane, fly_plane.src))
+        fly_plane.add_effect(at(fly_plane.plane, fly_plane.src), False)
+        fly_plane.add_effect(at(fly_plane.plane, fly_plane.tgt), True)
+
+        self.actions = [load, unload, move, fly_plane]
+
+    def encode(self, pb: HierarchicalProblem) -> Problem:
+        problem = Problem(f"{pb.name}_classical", pb.environment)
+        for fluent in (self.loc, self.at, self.same_city):
+            problem.add_fluent(fluent, default_initial_value=False)
+        problem.add_actions(self.actions)
+        problem.add_objects(pb.all_objects)
+        city_locations: Dict[Any, List[Any]] = {}
+        for fluent_exp, value in pb.explicit_initial_values.items():
+            name, obj = fluent_exp.fluent().name, fluent_exp.arg(0)
+            if name == "city":
+                city_locations.setdefault(value, []).append(obj)
+            elif name == "loc":
+                problem.set_initial_value(self.loc(obj, value), True)
+            elif name == "at":
+                problem.set_initial_value(self.at(obj, value), True)
+        for locations in city_locations.values():
+            for l1 in locations:
+                for l2 in locations:
+                    problem.set_initial_value(self.same_city(l1, l2), True)
+        for goal in pb.goals:
+            # loc(package) == l / at(vehicle) == l
+            fluent_exp, value = goal.arg(0), goal.arg(1)
+            fluent = self.loc if fluent_exp.fluent().name == "loc" else self.at
+            problem.add_goal(fluent(fluent_exp.arg(0), value))
+        return problem
+
+    def decode(self, plan: up.plans.SequentialPlan, pb: HierarchicalProblem) -> up.plans.SequentialPlan:
+        actions = {a.name: a for a in pb.actions}
+        return up.plans.SequentialPlan([
+            up.plans.ActionInstance(actions[ai.action.name], ai.actual_parameters)
+            for ai in plan.actions
+        ])
+
+
+class FlatEncodingEngine:
+    '''
+    Engine solving the classical encoding of the hierarchical problems (see
+    ClassicalEncoding) with a classical `planner`, e.g. a unified-planning
+    OneshotPlanner.
+    '''
+    def __init__(self, planner: Any):
+        self.planner = planner
+        self.encoding: Optional[ClassicalEncoding] = None
+
+    def solve(self, pb: HierarchicalProblem) -> PlanGenerationResult:
+        if self.encoding is None:
+            self.encoding = ClassicalEncoding(pb)
+        problem = self.encoding.encode(pb)
+        result = self.planner.solve(problem)
+        plan = result.plan
+        if plan is not None:
+            plan = self.encoding.decode(convert_plan(plan, problem), pb)
+        return PlanGenerationResult(result.status, plan, result.engine_name, result.metrics, result.log_messages)
+
+
+class Portfolio(LoopService):
+    '''
+    Solves every problem with all the `members` (name, client) at once, e.g.
+    Graphene on the hierarchical encoding and some classical planners on the
+    flat one (see FlatEncodingEngine). The first plan accepted by the
+    validator is returned and the other solves are cancelled; with a `budget`,
+    the members keep solving for `budget` seconds after the first plan and
+    the shortest valid plan is returned.
+
+    Without any plan, a member's proof that there's none is returned; the
+    first error raised by a member comes before the other negative results
+    (e.g. unsupported problem), which would be cached as if there were no plan.
+    '''
+    def __init__(self, members: List[Tuple[str, AsyncEngineClient]], budget: Optional[float] = None):
+        super().__init__()
+        assert members
+        self.members = members
+        self.budget = budget
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        for _, client in self.members:
+            client.start()
+        super().start()
+
+    def stop(self):
+        super().stop()
+        for _, client in self.members:
+            client.stop()
+
+    async def solve(
+        self,
+        pb: HierarchicalProblem,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+    ) -> PlanGenerationResult:
+        loop = asyncio.get_running_loop()
+        solves = {
+            asyncio.wrap_future(client.submit(pb, timeout, deadline)): name
+            for name, client in self.members
+        }
+        pending = set(solves)
+        best: Optional[Tuple[str, PlanGenerationResult]] = None
+        negative: Optional[PlanGenerationResult] = None
+        error: Optional[BaseException] = None
+        budget_end: Optional[float] = None
+        try:
+            while pending:
+                wait_timeout = None
+                if best is not None:
+                    if budget_end is None:
+                        break
+                    wait_timeout = max(0.0, budget_end - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # budget over
+                    break
+                for solve in done:
+                    name = solves[solve]
+                    if solve.exception() is not None:
+                        self.logger.info(f"Portfolio member {name} failed: {solve.exception()}")
+                        error = error or solve.exception()
+                        continue
+                    result = solve.result()
+                    if result.plan is None or result.status not in POSITIVE_OUTCOMES:
+                        if negative is None or result.status == PlanGenerationResultStatus.UNSOLVABLE_PROVEN:
+                            negative = result
+                        continue
+                    try:
+                        plan = convert_plan(result.plan, pb)
+                        valid = validate_plan(pb, plan)
+                    except Exception as e:
+                        # only this member failed, the others keep racing
+                        self.logger.info(f"Plan of portfolio member {name} can't be checked: {e}")
+                        error = error or e
+                        continue
+                    if not valid:
+                        PORTFOLIO_INVALID.inc(name)
+                        self.logger.warning(f"Invalid plan from portfolio member {name}")
+                        continue
+                    result = PlanGenerationResult(result.status, plan, result.engine_name, result.metrics, result.log_messages)
+                    if best is None or len(plan.actions) < len(best[1].plan.actions):
+                        best = (name, result)
+                    if budget_end is None and self.budget is not None:
+                        budget_end = loop.time() + self.budget
+        finally:
+            for solve in pending:
+                solve.cancel()
+        if best is not None:
+            PORTFOLIO_WINS.inc(best[0])
+            return best[1]
+        if negative is not None and (error is None or negative.status == PlanGenerationResultStatus.UNSOLVABLE_PROVEN):
+            return negative
+        assert error is not None
+        raise error
+
+
+def flat_portfolio_members(
+    planners: List[str],
+    max_concurrent: int,
+    timeout: Optional[float] = None,
+    retries: int = 0,
+) -> List[Tuple[str, AsyncEngineClient]]:
+    # unified-planning classical planners on the flat encoding, by engine name
+    return [
+        (name, AsyncEngineClient(
+            lambda name=name: FlatEncodingEngine(OneshotPlanner(name=name)),
+            max_concurrent, timeout, retries,
+        ))
+        for name in planners
+    ]
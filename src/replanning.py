@@ -0,0 +1,105 @@
+from collections import Counter
+from typing import Dict, Optional, Set, Tuple
+
+from plan_cache import CachedPlan
+from topology import TopologyIndex, get_topology
+
+# Incremental replanning: when a solved instance is edited, the actions of the
+# objects that the edit can't affect are kept and only the rest is solved again.
+#
+# The objects of the previous plan are split into components: a package and
+# the vehicles it has been loaded into are in the same component. Components
+# share no object, so the actions of a component are a valid plan for its
+# objects alone, whatever is done with the other objects. A component is kept
+# when none of its objects changed start or destination, and none of its
+# vehicles is needed by the packages to solve again (the trucks of their cities,
+# an airplane when they change city). The other components, the new objects and
+# the vehicles never used by the previous plan form the instance left to solve.
+
+
+class PreviousSolve:
+    '''The instance solved last by a session, with its plan.'''
+    def __init__(self, input_values: Dict[str, Tuple[int, int]], plan: CachedPlan):
+        self.input_values = dict(input_values)
+        self.plan = plan
+
+
+def _plan_components(objects: Dict[str, Tuple[int, int]], plan: CachedPlan) -> Dict[str, int]:
+    # object name -> index of its component, only for the objects used by the plan
+    parent: Dict[str, str] = {}
+
+    def find(name: str) -> str:
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for _, params in plan:
+        names = [p for p in params if p in objects]
+        for name in names:
+            parent.setdefault(name, name)
+        for name in names[1:]:
+            parent[find(name)] = find(names[0])
+    roots: Dict[str, int] = {}
+    return {name: roots.setdefault(find(name), len(roots)) for name in parent}
+
+
+def split_for_repair(
+    previous: PreviousSolve,
+    input_values: Dict[str, Tuple[int, int]],
+    topology: Optional[TopologyIndex] = None,
+) -> Optional[Tuple[CachedPlan, Dict[str, Tuple[int, int]]]]:
+    '''
+    Returns the actions of the previous plan that are still valid and the
+    instance that is left to solve, or None when nothing can be kept.
+    '''
+    if topology is None:
+        topology = get_topology()
+    locations = [l for values in input_values.values() for l in values]
+    if not topology.valid(locations).all():
+        return None
+    components = _plan_components(previous.input_values, previous.plan)
+    sizes = Counter(components.values())
+    truck_components: Dict[int, Set[int]] = {}
+    airplane_components: Set[int] = set()
+    for name, component in components.items():
+        if name.startswith("truck_"):
+            city = int(topology.city_of[previous.input_values[name][0]])
+            truck_components.setdefault(city, set()).add(component)
+        elif name.startswith("airplane_"):
+            airplane_components.add(component)
+
+    released = set()
+    for name, values in previous.input_values.items():
+        if name in components and input_values.get(name, None) != values:
+            released.add(components[name])
+    while True:
+        remaining = {
+            name: values for name, values in input_values.items()
+            if name not in components or components[name] in released
+        }
+        # the vehicles of the kept components are busy: the remaining packages
+        # get the trucks of their cities, and an airplane if they fly
+        needed: Set[int] = set()
+        flying = False
+        for name, (start, dest) in remaining.items():
+            if name.startswith("package_"):
+                start_city, dest_city = int(topology.city_of[start]), int(topology.city_of[dest])
+                needed |= truck_components.get(start_city, set()) | truck_components.get(dest_city, set())
+                flying = flying or start_city != dest_city
+        if flying and airplane_components and not any(name.startswith("airplane_") for name in remaining):
+            needed.add(min(airplane_components, key=sizes.get))
+        needed -= released
+        if not needed:
+            break
+        released |= needed
+    kept = set(components.values()) - released
+    if not kept:
+        return None
+
+    kept_plan: CachedPlan = []
+    for action_name, params in previous.plan:
+        component = next(components[p] for p in params if p in components)
+        if component in kept:
+            kept_plan.append((action_name, params))
+    return kept_plan, remaining
@@ -9,41 +9,158 @@ import os
 # sys.path.append(tsb_space_src_dir)
 
 
-import asyncio
+from startup import StartupTimer, prewarm
 
-from up_graphene_engine.engine import GrapheneEngine
+# started before any other import, all of them are timed
+STARTUP = StartupTimer()
 
+with STARTUP.stage("import_service"):
+    from plan_cache import PlanCache
+    from scheduler import PlanningScheduler
+    from native_solver import NativeLogisticSolver
+    from engine_client import AsyncEngineClient, ClientEngine
+    from metrics import set_trace_dump_file, start_metrics_server
+    from threading import Thread
 
-from gui import Gui, reload_page
-from modified_planning import planning
-from threading import Thread
 
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", 256))
+PLAN_CACHE_TTL = float(os.environ["PLAN_CACHE_TTL"]) if "PLAN_CACHE_TTL" in os.environ else None
+PLAN_CACHE_DIR = os.environ.get("PLAN_CACHE_DIR", None)
 
+PLANNING_WORKERS = int(os.environ.get("PLANNING_WORKERS", 4))
+PLANNING_QUEUE_DEPTH = int(os.environ.get("PLANNING_QUEUE_DEPTH", 16))
+# a request is abandoned after PLANNING_REQUEST_TIMEOUT seconds, queue wait included;
+# every solve by the planner after PLANNER_TIMEOUT seconds, and tried again PLANNER_RETRIES times
+PLANNING_REQUEST_TIMEOUT = float(os.environ.get("PLANNING_REQUEST_TIMEOUT", 120))
+PLANNER_TIMEOUT = float(os.environ.get("PLANNER_TIMEOUT", 60))
+PLANNER_RETRIES = int(os.environ.get("PLANNER_RETRIES", 1))
+# unified-planning classical planners (comma separated) racing Graphene on the flat
+# encoding; with PORTFOLIO_BUDGET they get that many seconds to find a shorter plan
+PORTFOLIO_PLANNERS = [p for p in os.environ.get("PORTFOLIO_PLANNERS", "").split(",") if p]
+PORTFOLIO_BUDGET = float(os.environ["PORTFOLIO_BUDGET"]) if "PORTFOLIO_BUDGET" in os.environ else None
+# solve in-process when possible, using the Graphene planner only as fallback
+NATIVE_SOLVER = os.environ.get("NATIVE_SOLVER", "1") == "1"
+# engines solving the independent groups of the big instances, 0 disables the decomposition
+DECOMPOSE_WORKERS = int(os.environ.get("DECOMPOSE_WORKERS", 0))
+DECOMPOSE_MIN_PACKAGES = int(os.environ.get("DECOMPOSE_MIN_PACKAGES", 8))
+# keep the plan of the objects not changed since the last DELIVER of a session
+INCREMENTAL_REPLANNING = os.environ.get("INCREMENTAL_REPLANNING", "1") == "1"
+# main pages kept in memory, the idle ones are freed after PAGE_IDLE_SECONDS
+MAX_PAGES = int(os.environ.get("MAX_PAGES", 256))
+PAGE_IDLE_SECONDS = float(os.environ.get("PAGE_IDLE_SECONDS", 3600))
 
-def main():
+# shorten the plans with the local optimizer (see optimizer.py)
+OPTIMIZE_PLANS = os.environ.get("OPTIMIZE_PLANS", "1") == "1"
 
-    engine = GrapheneEngine(port=8061)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 8063))
+TRACE_DUMP_FILE = os.environ.get("TRACE_DUMP_FILE", None)
+# import unified-planning and build the domain in the background once serving,
+# instead of on the first planning request
+PREWARM = os.environ.get("PREWARM", "1") == "1"
 
-    gui = Gui()
 
-    gui_thread = Thread(target=gui.show_gui_thread)
-    gui_thread.start()
+def graphene_engine():
+    # the client creates its engines on the first solves
+    from up_graphene_engine.engine import GrapheneEngine
+    return GrapheneEngine(port=8061)
 
-    while True:
-        # wait for the user input to start planning
-        gui.start_queue.get(block=True)
-        gui.plan = planning(engine, gui, reload_page)
 
-        gui.update_planning_execution()
+def prewarm_planning():
+    import modified_planning
 
-        gui.reset_execution()
-        asyncio.run(reload_page())
 
+def prewarm_domain():
+    from domain_template import get_domain_template
+    from simulator import get_simulator
+    get_domain_template()
+    get_simulator()
 
-    server.wait_for_termination()
+
+def prewarm_engine():
+    import up_graphene_engine.engine
+
+
+def main():
+
+    with STARTUP.stage("metrics_server"):
+        start_metrics_server(METRICS_PORT)
+        set_trace_dump_file(TRACE_DUMP_FILE)
+
+    plan_cache = PlanCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL, PLAN_CACHE_DIR)
+
+    # all the solves by the planner go through the client, which never waits forever
+    engine_client = AsyncEngineClient(
+        graphene_engine,
+        max_concurrent=PLANNING_WORKERS + DECOMPOSE_WORKERS,
+        timeout=PLANNER_TIMEOUT,
+        retries=PLANNER_RETRIES,
+    )
+    if PORTFOLIO_PLANNERS:
+        with STARTUP.stage("import_portfolio"):
+            from portfolio import Portfolio, flat_portfolio_members
+        members = [("graphene", engine_client)] + flat_portfolio_members(
+            PORTFOLIO_PLANNERS, PLANNING_WORKERS + DECOMPOSE_WORKERS, PLANNER_TIMEOUT, PLANNER_RETRIES,
+        )
+        engine_client = Portfolio(members, PORTFOLIO_BUDGET)
+    engine_client.start()
+
+    native_solver = NativeLogisticSolver() if NATIVE_SOLVER else None
+    decomposer = None
+    if DECOMPOSE_WORKERS > 0:
+        with STARTUP.stage("import_decomposition"):
+            from decomposition import ProblemDecomposer
+        decomposer = ProblemDecomposer(
+            lambda: ClientEngine(engine_client),
+            workers=DECOMPOSE_WORKERS,
+            engine_client=engine_client,
+            min_packages=DECOMPOSE_MIN_PACKAGES,
+            plan_cache=plan_cache,
+            native_solver=native_solver,
+            optimize_plans=OPTIMIZE_PLANS,
+        )
+        decomposer.start()
+
+    # several problems are solved at once, each one by its own worker
+    scheduler = PlanningScheduler(
+        None,
+        workers=PLANNING_WORKERS,
+        max_queue_depth=PLANNING_QUEUE_DEPTH,
+        plan_cache=plan_cache,
+        native_solver=native_solver,
+        decomposer=decomposer,
+        engine_client=engine_client,
+        request_timeout=PLANNING_REQUEST_TIMEOUT,
+        optimize_plans=OPTIMIZE_PLANS,
+    )
+    scheduler.start()
+
+    with STARTUP.stage("import_gui"):
+        from gui import Gui
+    gui = Gui()
+    gui.scheduler = scheduler
+    gui.incremental_replanning = INCREMENTAL_REPLANNING
+    gui.max_pages = MAX_PAGES
+    gui.page_idle_timeout = PAGE_IDLE_SECONDS
+
+    def serving():
+        STARTUP.ready()
+        if PREWARM:
+            prewarm(STARTUP, [
+                ("planning", prewarm_planning),
+                ("domain", prewarm_domain),
+                ("engine", prewarm_engine),
+            ])
+
+    gui_thread = Thread(target=gui.show_gui_thread, args=(serving,))
+    gui_thread.start()
 
     gui_thread.join()
 
+    scheduler.stop()
+    if decomposer is not None:
+        decomposer.stop()
+    engine_client.stop()
+
 if __name__ == "__main__":
     # asyncio.run(main())
     main()
@@ -0,0 +1,233 @@
+import itertools
+import logging
+import queue
+import time
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from feasibility import Feasibility, check_feasibility
+from plan_cache import PlanCache
+from metrics import RequestTrace
+from native_solver import NativeLogisticSolver
+from replanning import PreviousSolve
+from engine_client import ClientEngine, EngineTimeout, LoopService, SolveCancelled
+
+if TYPE_CHECKING:
+    import unified_planning as up
+    from up_graphene_engine.engine import GrapheneEngine
+    from decomposition import ProblemDecomposer
+    from modified_planning import DecompositionTree
+
+
+class SchedulerBusy(Exception):
+    '''Raised by PlanningScheduler.submit when the queue of pending jobs is full.'''
+    pass
+
+
+class PlanningJob:
+    def __init__(
+        self,
+        job_id: int,
+        input_values: Dict[str, Tuple[int, int]],
+        session: Any,
+        on_done: Optional[Callable[["PlanningJob"], None]],
+        parent_trace: Optional[RequestTrace] = None,
+        previous: Optional[PreviousSolve] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.job_id = job_id
+        # copied, so the submitter can change its values while the job is pending
+        self.input_values = dict(input_values)
+        # whoever submitted the job; the scheduler never looks into it
+        self.session = session
+        self.on_done = on_done
+        # the last instance solved by the submitter, for incremental replanning
+        self.previous = previous
+
+        self.plan: Optional["up.plans.SequentialPlan"] = None
+        # the tasks decomposed by the planner, when the scheduler keeps them
+        self.decomposition: Optional["DecompositionTree"] = None
+        # the failed feasibility check, when the instance has no plan
+        self.infeasible: Optional[Feasibility] = None
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+        # set while the job is solved through an AsyncEngineClient, to cancel it
+        self.engine: Optional[ClientEngine] = None
+        # time.monotonic() value, the queue wait counts
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+
+        self.trace = RequestTrace(job_id, parent=parent_trace)
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = Event()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def cancel(self):
+        # a pending job is never solved; a running one is interrupted only when
+        # solved through an AsyncEngineClient, otherwise its result is just dropped
+        self.cancelled = True
+        engine = self.engine
+        if engine is not None:
+            engine.cancel()
+
+
+class PlanningScheduler:
+    '''
+    Solves the submitted planning jobs with a pool of `workers` threads, each
+    one with its own engine created by `engine_factory`, or sharing the
+    engines of `engine_client`, which bounds every job to `request_timeout`
+    seconds and interrupts the cancelled ones. At most `max_queue_depth` jobs
+    can wait for a worker, further submissions are rejected with
+    SchedulerBusy. When a job is done, or cancelled, its `on_done` callback is
+    called from the worker thread. With `decompositions`, the decomposition
+    tree of the hierarchical plans is kept in the jobs.
+    '''
+    def __init__(
+        self,
+        engine_factory: Optional[Callable[[], "GrapheneEngine"]],
+        workers: int = 1,
+        max_queue_depth: int = 16,
+        plan_cache: Optional[PlanCache] = None,
+        native_solver: Optional[NativeLogisticSolver] = None,
+        decomposer: Optional["ProblemDecomposer"] = None,
+        engine_client: Optional[LoopService] = None,
+        request_timeout: Optional[float] = None,
+        optimize_plans: bool = False,
+        decompositions: bool = False,
+    ):
+        assert workers > 0
+        assert engine_factory is not None or engine_client is not None
+        self.engine_factory = engine_factory
+        self.workers = workers
+        self.plan_cache = plan_cache
+        self.native_solver = native_solver
+        self.decomposer = decomposer
+        self.engine_client = engine_client
+        self.request_timeout = request_timeout
+        self.optimize_plans = optimize_plans
+        self.decompositions = decompositions
+        self._queue: "queue.Queue[Optional[PlanningJob]]" = queue.Queue(maxsize=max_queue_depth)
+        self._ids = itertools.count(1)
+        self._threads: List[Thread] = []
+        self._running_lock = Lock()
+        self.running_jobs = 0
+
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = Thread(target=self._worker, name=f"planning-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(
+        self,
+        input_values: Dict[str, Tuple[int, int]],
+        session: Any = None,
+        on_done: Optional[Callable[[PlanningJob], None]] = None,
+        block: bool = False,
+        parent_trace: Optional[RequestTrace] = None,
+        previous: Optional[PreviousSolve] = None,
+        deadline: Optional[float] = None,
+    ) -> PlanningJob:
+        # with block, wait for a free slot in the queue instead of raising SchedulerBusy;
+        # `deadline` (a time.monotonic() value, e.g. the one of a parent job)
+        # bounds the job together with request_timeout
+        job = PlanningJob(
+            next(self._ids), input_values, session, on_done, parent_trace, previous,
+            self.request_timeout if self.engine_client is not None else None,
+        )
+        if deadline is not None and self.engine_client is not None:
+            job.deadline = deadline if job.deadline is None else min(job.deadline, deadline)
+        try:
+            self._queue.put(job, block=block)
+        except queue.Full:
+            self.logger.info(f"Rejecting job {job.job_id}, {self.queue_depth()} jobs pending")
+            raise SchedulerBusy(f"Too many pending planning jobs ({self.queue_depth()})")
+        self.logger.info(f"Submitted job {job.job_id}")
+        return job
+
+    @staticmethod
+    def _decomposition_keeper(job: PlanningJob) -> Callable[["DecompositionTree"], None]:
+        def keep(tree: "DecompositionTree"):
+            job.decomposition = tree
+        return keep
+
+    def _worker(self):
+        # created by the first job needing it, a failure is the error of that job
+        engine = None
+        while True:
+            job = self._queue.get(block=True)
+            if job is None:
+                break
+            with self._running_lock:
+                self.running_jobs += 1
+            job.started_at = time.time()
+            job.trace.observe("queue_wait", job.started_at - job.submitted_at)
+            try:
+                if job.cancelled:
+                    raise SolveCancelled(f"Job {job.job_id} cancelled")
+                # the instances without any plan never reach the planner
+                with job.trace.stage("feasibility"):
+                    feasibility = check_feasibility(job.input_values)
+                if feasibility:
+                    if self.engine_client is not None:
+                        job_engine = job.engine = ClientEngine(self.engine_client, deadline=job.deadline)
+                        if job.cancelled:
+                            job.engine.cancel()
+                    else:
+                        if engine is None:
+                            engine = self.engine_factory()
+                        job_engine = engine
+                    # unified-planning is imported by the first job, not at startup
+                    from modified_planning import planning
+                    job.plan = planning(
+                        job_engine, job.input_values, self.logger, self.plan_cache,
+                        trace=job.trace, native_solver=self.native_solver,
+                        decomposer=self.decomposer, previous=job.previous,
+                        optimize=self.optimize_plans,
+                        on_decomposition=self._decomposition_keeper(job) if self.decompositions else None,
+                    )
+                else:
+                    job.infeasible = feasibility
+                    self.logger.info(f"Job {job.job_id} has no plan: {feasibility.message}")
+            except SolveCancelled as e:
+                self.logger.info(f"Job {job.job_id} cancelled")
+                job.error = e
+            except EngineTimeout as e:
+                self.logger.warning(f"Job {job.job_id} timed out: {e}")
+                job.error = e
+            except Exception as e:
+                self.logger.exception(f"Job {job.job_id} failed")
+                job.error = e
+            job.engine = None
+            job.finished_at = time.time()
+            with self._running_lock:
+                self.running_jobs -= 1
+            job.done.set()
+            if job.on_done is not None:
+                try:
+                    job.on_done(job)
+                except Exception:
+                    self.logger.exception(f"Callback of job {job.job_id} failed")
+            if job.cancelled:
+                job.trace.finish("cancelled")
+            elif job.error is not None:
+                job.trace.finish("timeout" if isinstance(job.error, EngineTimeout) else "error")
+            elif job.infeasible is not None:
+                job.trace.finish("infeasible")
+            else:
+                job.trace.finish(job.trace.outcome_of(job.plan))
@@ -0,0 +1,136 @@
+from typing import Dict, List, Optional, Tuple
+
+from logistic_map import LOCATIONS_MAP
+from plan_cache import CachedPlan
+from topology import NO_CITY, TopologyIndex, get_topology
+
+# Simulation of the logistic plans on integer state arrays, with the semantics
+# of the load/unload/move/fly-plane actions of the domain.
+#
+# Objects are indexed in input order; the state is one int per object: the
+# location id for the objects on the ground, and for a package inside a
+# vehicle -(index of the vehicle + 1).
+
+
+class SimulationResult:
+    __slots__ = ("valid", "failed_step", "error", "timelines")
+
+    def __init__(
+        self,
+        valid: bool,
+        failed_step: Optional[int] = None,
+        error: Optional[str] = None,
+        timelines: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+    ):
+        self.valid = valid
+        # index of the first action that can't be applied, len(plan) when the
+        # goals aren't reached at the end, None for a valid plan
+        self.failed_step = failed_step
+        self.error = error
+        # vehicle -> [(step, location id)], the initial location at step -1
+        self.timelines = timelines
+
+    def __bool__(self) -> bool:
+        return self.valid
+
+    def __repr__(self) -> str:
+        if self.valid:
+            return "SimulationResult(valid)"
+        return f"SimulationResult(step {self.failed_step}: {self.error})"
+
+
+class LogisticSimulator:
+    def __init__(self, locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP):
+        self.topology: TopologyIndex = get_topology(locations_map)
+        topology = self.topology
+        self.city_of: List[int] = topology.city_of.tolist()
+        self.is_airport: List[bool] = topology.is_airport.tolist()
+        # name of every location of the map -> its id
+        self.location_ids: Dict[str, int] = {
+            topology.location_name(l): l for l in range(topology.max_location_id + 1) if topology.is_location[l]
+        }
+
+    def simulate(
+        self,
+        input_values: Dict[str, Tuple[int, int]],
+        plan: CachedPlan,
+        timelines: bool = False,
+    ) -> SimulationResult:
+        city_of, is_airport, location_ids = self.city_of, self.is_airport, self.location_ids
+        index: Dict[str, int] = {}
+        kinds: List[str] = []
+        state: List[int] = []
+        for i, (name, (start, dest)) in enumerate(input_values.items()):
+            index[name] = i
+            kinds.append(name.split("_")[0])
+            for location in (start, dest):
+                if not 0 <= location < len(city_of) or city_of[location] == NO_CITY:
+                    return SimulationResult(False, -1, f"{name} has unknown location {location}")
+            state.append(start)
+        vehicle_timelines: Optional[Dict[str, List[Tuple[int, int]]]] = None
+        if timelines:
+            vehicle_timelines = {
+                name: [(-1, state[i])] for name, i in index.items() if kinds[i] != "package"
+            }
+
+        def fail(step: int, error: str) -> SimulationResult:
+            return SimulationResult(False, step, error, vehicle_timelines)
+
+        for step, (action_name, params) in enumerate(plan):
+            if len(params) != 3:
+                return fail(step, f"{action_name} has {len(params)} parameters")
+            if action_name in ("load", "unload"):
+                first, vehicle, location_name = params
+                p, v, l = index.get(first, -1), index.get(vehicle, -1), location_ids.get(location_name, -1)
+                if p < 0 or kinds[p] != "package":
+                    return fail(step, f"{first} is not a package")
+                if v < 0 or kinds[v] == "package":
+                    return fail(step, f"{vehicle} is not a vehicle")
+                if l < 0:
+                    return fail(step, f"{location_name} is not a location")
+                if state[v] != l:
+                    return fail(step, f"{vehicle} is not at {location_name}")
+                if action_name == "load":
+                    if state[p] != l:
+                        return fail(step, f"{first} is not at {location_name}")
+                    state[p] = -(v + 1)
+                else:
+                    if state[p] != -(v + 1):
+                        return fail(step, f"{first} is not in {vehicle}")
+                    state[p] = l
+            elif action_name in ("move", "fly-plane"):
+                vehicle, src_name, tgt_name = params
+                v, src, tgt = index.get(vehicle, -1), location_ids.get(src_name, -1), location_ids.get(tgt_name, -1)
+                expected_kind = "truck" if action_name == "move" else "airplane"
+                if v < 0 or kinds[v] != expected_kind:
+                    return fail(step, f"{vehicle} is not a {expected_kind}")
+                if src < 0 or tgt < 0:
+                    return fail(step, f"{src_name if src < 0 else tgt_name} is not a location")
+                if state[v] != src:
+                    return fail(step, f"{vehicle} is not at {src_name}")
+                if action_name == "move" and city_of[src] != city_of[tgt]:
+                    return fail(step, f"{src_name} and {tgt_name} are in different cities")
+                if action_name == "fly-plane" and not (is_airport[src] and is_airport[tgt]):
+                    return fail(step, f"{src_name} or {tgt_name} is not an airport")
+                state[v] = tgt
+                if vehicle_timelines is not None:
+                    vehicle_timelines[vehicle].append((step, tgt))
+            else:
+                return fail(step, f"unknown action {action_name}")
+
+        for name, (_, dest) in input_values.items():
+            if state[index[name]] != dest:
+                return fail(len(plan), f"{name} is not at {self.topology.location_name(dest)}")
+        return SimulationResult(True, None, None, vehicle_timelines)
+
+
+_simulators: Dict[int, Tuple[Dict[str, Tuple[int, ...]], LogisticSimulator]] = {}
+
+
+def get_simulator(locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP) -> LogisticSimulator:
+    # one simulator per map, like get_topology
+    entry = _simulators.get(id(locations_map), None)
+    if entry is None or entry[0] is not locations_map:
+        entry = (locations_map, LogisticSimulator(locations_map))
+        _simulators[id(locations_map)] = entry
+    return entry[1]
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from threading import Thread
+from typing import Any, Callable, List, Sequence, Tuple
+
+from metrics import METRICS
+
+# The service starts serving before importing unified-planning and building
+# the domain: the heavy modules are imported where they are first used, and
+# pre-warmed in the background once the ports are open, so a new replica can
+# take requests as soon as possible. Every stage of the startup is timed.
+
+STARTUP_SECONDS = METRICS.gauge("startup_stage_seconds", "Time spent in every stage of the startup, imports included.", ("stage",))
+STARTUP_READY_SECONDS = METRICS.gauge("startup_ready_seconds", "Time from the start of the service until its ports are open.")
+PREWARM_SECONDS = METRICS.gauge("startup_prewarm_seconds", "Time from the start of the service until the end of the pre-warming.")
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        # (stage, seconds) in the order they ran
+        self.stages: List[Tuple[str, float]] = []
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.INFO)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stages.append((stage, seconds))
+            STARTUP_SECONDS.set(seconds, stage)
+            self.logger.info(f"Startup stage {stage}: {seconds:.3f}s")
+
+    def ready(self):
+        seconds = self.elapsed()
+        STARTUP_READY_SECONDS.set(seconds)
+        self.logger.info(f"Serving after {seconds:.3f}s ({self.summary()})")
+
+    def summary(self) -> str:
+        return ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in self.stages)
+
+
+async def when_serving(host: str, port: int, callback: Callable[[], Any], interval: float = 0.05):
+    '''
+    Calls `callback` once `port` accepts connections, e.g. from the startup
+    hook of the web server, which runs before the server binds its port.
+    '''
+    # the wildcard addresses can't be connected to
+    host = {"0.0.0.0": "127.0.0.1", "::": "::1", "": "127.0.0.1"}.get(host, host)
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(interval)
+            continue
+        writer.close()
+        break
+    callback()
+
+
+def prewarm(timer: StartupTimer, steps: Sequence[Tuple[str, Callable[[], Any]]]) -> Thread:
+    '''
+    Runs the (stage, function) steps one after the other in a daemon thread,
+    e.g. the imports and the domain template the first request would otherwise
+    wait for. A failed step is logged and skipped: the request needing it will
+    do it again, and fail there.
+    '''
+    def run():
+        for stage, step in steps:
+            try:
+                with timer.stage(f"prewarm_{stage}"):
+                    step()
+            except Exception:
+                timer.logger.exception(f"Pre-warming {stage} failed")
+        PREWARM_SECONDS.set(timer.elapsed())
+        timer.logger.info(f"Pre-warmed after {timer.elapsed():.3f}s")
+
+    thread = Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,71 @@
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from logistic_map import LOCATIONS_MAP
+
+# Precomputed topology of a map: which city every location is in, which
+# location is the airport of every city and which locations share a city.
+# Everything is stored in numpy arrays indexed by location id (index 0 is
+# unused, location ids start from 1) and by city index, so the questions asked
+# for every object of an instance are answered with a single array operation.
+
+NO_CITY = -1
+
+
+class TopologyIndex:
+    def __init__(self, locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP):
+        self.city_names = [c for c, locations in locations_map.items() if locations]
+        max_id = max((max(l) for l in locations_map.values() if l), default=0)
+        self.max_location_id = max_id
+
+        # location id -> city index (NO_CITY for unknown ids)
+        self.city_of = np.full(max_id + 1, NO_CITY, dtype=np.int32)
+        # city index -> location id of its airport
+        self.airport_of_city = np.zeros(len(self.city_names), dtype=np.int32)
+        self.is_airport = np.zeros(max_id + 1, dtype=bool)
+        for city_index, city_name in enumerate(self.city_names):
+            locations = locations_map[city_name]
+            self.city_of[list(locations)] = city_index
+            self.airport_of_city[city_index] = locations[0]
+            self.is_airport[locations[0]] = True
+        self.is_location = self.city_of != NO_CITY
+
+    def valid(self, location_ids: Sequence[int]) -> np.ndarray:
+        ids = np.asarray(location_ids, dtype=np.int64)
+        in_range = (ids >= 0) & (ids <= self.max_location_id)
+        result = np.zeros(ids.shape, dtype=bool)
+        result[in_range] = self.is_location[ids[in_range]]
+        return result
+
+    def cities(self, location_ids: Sequence[int]) -> np.ndarray:
+        return self.city_of[np.asarray(location_ids, dtype=np.int64)]
+
+    def airports(self, location_ids: Sequence[int]) -> np.ndarray:
+        # the airport of the city of every given location
+        return self.airport_of_city[self.cities(location_ids)]
+
+    def in_same_city(self, a: Sequence[int], b: Sequence[int]) -> np.ndarray:
+        # element-wise
+        cities_a, cities_b = self.cities(a), self.cities(b)
+        return (cities_a == cities_b) & (cities_a != NO_CITY)
+
+    def city_name(self, location_id: int) -> str:
+        return self.city_names[self.city_of[location_id]]
+
+    def location_name(self, location_id: int) -> str:
+        if self.is_airport[location_id]:
+            return f"airport_{location_id}"
+        return f"location_{location_id}"
+
+
+_topologies: Dict[int, Tuple[Dict[str, Tuple[int, ...]], TopologyIndex]] = {}
+
+
+def get_topology(locations_map: Dict[str, Tuple[int, ...]] = LOCATIONS_MAP) -> TopologyIndex:
+    # one index per map; the map is kept in the entry, so its id can't be reused
+    entry = _topologies.get(id(locations_map), None)
+    if entry is None or entry[0] is not locations_map:
+        entry = (locations_map, TopologyIndex(locations_map))
+        _topologies[id(locations_map)] = entry
+    return entry[1]
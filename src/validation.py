@@ -0,0 +1,35 @@
+from typing import TYPE_CHECKING, Dict, Tuple
+
+from plan_cache import CachedPlan, plan_to_cached
+from simulator import SimulationResult, get_simulator
+
+if TYPE_CHECKING:
+    import unified_planning as up
+    from unified_planning.model.htn import HierarchicalProblem
+
+# Validation of the plans we build ourselves (merged, repaired, optimized, ...)
+# and of the ones returned by the planners, with the native simulator of the
+# domain instead of the generic unified-planning validator.
+
+
+def validate_cached(input_values: Dict[str, Tuple[int, int]], plan: CachedPlan) -> SimulationResult:
+    return get_simulator().simulate(input_values, plan)
+
+
+def instance_of(pb: "HierarchicalProblem") -> Dict[str, Tuple[int, int]]:
+    # the input values a problem has been instantiated from
+    location_ids = get_simulator().location_ids
+    starts: Dict[str, int] = {}
+    for fluent_exp, value in pb.explicit_initial_values.items():
+        if fluent_exp.fluent().name in ("loc", "at"):
+            starts[fluent_exp.arg(0).object().name] = location_ids[value.object().name]
+    input_values = {}
+    for goal in pb.goals:
+        # loc(package) == l / at(vehicle) == l
+        name = goal.arg(0).arg(0).object().name
+        input_values[name] = (starts[name], location_ids[goal.arg(1).object().name])
+    return input_values
+
+
+def validate_plan(pb: "HierarchicalProblem", plan: "up.plans.SequentialPlan") -> SimulationResult:
+    return validate_cached(instance_of(pb), plan_to_cached(plan))
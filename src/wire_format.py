@@ -0,0 +1,132 @@
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+from map_store import KINDS
+
+if TYPE_CHECKING:
+    from plan_cache import CachedPlan
+
+# Compact binary encoding of the logistic plans, for the plans stored on disk
+# by the plan cache; the static domain and the map are never encoded.
+#
+# Integers are unsigned LEB128 varints. The objects are kind_number names,
+# sorted by kind and number: every kind is written as the count of its objects
+# followed by the deltas of their numbers.
+# A plan is b"LP1", 0 for the instances proven without plan, or 1, the object
+# table, the number of actions and for every action its code and three
+# parameters: objects by their index in the table, locations as 2 * id + 1
+# for airports and 2 * id otherwise.
+# A plan of n actions takes about 4n bytes.
+
+PLAN_MAGIC = b"LP1"
+
+ACTIONS = ("load", "unload", "move", "fly-plane")
+# which parameters of every action are locations
+LOCATION_PARAMS = {"load": (2,), "unload": (2,), "move": (1, 2), "fly-plane": (1, 2)}
+
+
+def _write_varint(out: bytearray, value: int):
+    if value < 0:
+        raise ValueError(f"Can't encode negative value {value}")
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data: bytes, offset: int) -> Iterator[int]:
+    value, shift = 0, 0
+    for i in range(offset, len(data)):
+        byte = data[i]
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            yield value
+            value, shift = 0, 0
+    if shift:
+        raise ValueError("Truncated varint")
+
+
+def _canonical_number(number: str) -> bool:
+    # the decoded names are written back without leading zeros
+    return number.isdigit() and number.isascii() and (number == "0" or not number.startswith("0"))
+
+
+def _split_name(name: str) -> Tuple[int, int]:
+    kind, _, number = name.partition("_")
+    if kind not in KINDS or not _canonical_number(number):
+        raise ValueError(f"Can't encode object name {name}")
+    return KINDS.index(kind), int(number)
+
+
+def _write_objects(out: bytearray, names: List[str]) -> List[str]:
+    # the names in table order
+    objects = sorted(_split_name(name) for name in names)
+    for kind in range(len(KINDS)):
+        numbers = [number for k, number in objects if k == kind]
+        _write_varint(out, len(numbers))
+        previous = 0
+        for number in numbers:
+            _write_varint(out, number - previous)
+            previous = number
+    return [f"{KINDS[kind]}_{number}" for kind, number in objects]
+
+
+def _read_objects(values: Iterator[int]) -> List[str]:
+    names = []
+    for kind in KINDS:
+        number = 0
+        for _ in range(next(values)):
+            number += next(values)
+            names.append(f"{kind}_{number}")
+    return names
+
+
+def encode_plan(plan: "CachedPlan") -> bytes:
+    out = bytearray(PLAN_MAGIC)
+    if plan is None:
+        out.append(0)
+        return bytes(out)
+    out.append(1)
+    for action_name, params in plan:
+        if action_name not in ACTIONS or len(params) != 3:
+            raise ValueError(f"Can't encode action {action_name}{params}")
+    objects = {p for action_name, params in plan for i, p in enumerate(params) if i not in LOCATION_PARAMS[action_name]}
+    index = {name: i for i, name in enumerate(_write_objects(out, list(objects)))}
+    _write_varint(out, len(plan))
+    for action_name, params in plan:
+        _write_varint(out, ACTIONS.index(action_name))
+        locations = LOCATION_PARAMS[action_name]
+        for i, param in enumerate(params):
+            if i in locations:
+                kind, _, location_id = param.partition("_")
+                if kind not in ("airport", "location") or not _canonical_number(location_id):
+                    raise ValueError(f"Can't encode location {param}")
+                _write_varint(out, 2 * int(location_id) + (kind == "airport"))
+            else:
+                _write_varint(out, index[param])
+    return bytes(out)
+
+
+def decode_plan(data: bytes) -> "CachedPlan":
+    if not data.startswith(PLAN_MAGIC) or len(data) <= len(PLAN_MAGIC):
+        raise ValueError("Not an encoded plan")
+    if data[len(PLAN_MAGIC)] == 0:
+        return None
+    values = _read_varints(data, len(PLAN_MAGIC) + 1)
+    try:
+        names = _read_objects(values)
+        plan = []
+        for _ in range(next(values)):
+            action_name = ACTIONS[next(values)]
+            locations = LOCATION_PARAMS[action_name]
+            params = []
+            for i in range(3):
+                value = next(values)
+                if i in locations:
+                    params.append(f"{'airport' if value & 1 else 'location'}_{value >> 1}")
+                else:
+                    params.append(names[value])
+            plan.append((action_name, tuple(params)))
+    except (StopIteration, IndexError):
+        raise ValueError("Truncated or corrupted plan")
+    return plan
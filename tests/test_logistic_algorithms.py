@@ -0,0 +1,246 @@
+import os
+import random
+import sys
+from typing import Dict, Iterator, Tuple
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from canonical import canonicalize, invert_renaming
+from domain_template import LogisticDomainTemplate
+from feasibility import check_feasibility
+from native_solver import NativeLogisticSolver
+from optimizer import optimize_plan
+from plan_cache import cached_to_plan, rename_cached
+from simulator import get_simulator
+from topology import get_topology
+from wire_format import decode_plan, encode_plan
+
+from unified_planning.engines.results import ValidationResultStatus
+from unified_planning.model import Problem
+from unified_planning.shortcuts import PlanValidator, get_environment
+
+# Checks of the algorithms that must give exact answers, on random instances
+# of a small map: every result is checked against the simulator of the domain
+# (see simulator.py), which is checked against the unified-planning validator.
+
+MAP: Dict[str, Tuple[int, ...]] = {
+    "city_1": (1, 2, 3, 4),
+    "city_5": (5, 6, 7),
+    "city_8": (8, 9, 10, 11),
+    "city_12": (12, 13),
+}
+INSTANCES = 500
+
+
+def random_instance(rng: random.Random) -> Dict[str, Tuple[int, int]]:
+    # trucks stay in their city and airplanes at the airports, some cities may
+    # have no truck and there may be no airplane
+    cities = list(MAP.values())
+    all_locations = [l for locations in cities for l in locations]
+    airports = [locations[0] for locations in cities]
+    input_values = {}
+    for i in range(1, rng.randint(1, 8) + 1):
+        input_values[f"package_{i}"] = (rng.choice(all_locations), rng.choice(all_locations))
+    truck_cities = [locations for locations in cities if rng.random() < 0.9] + rng.sample(cities, rng.randint(0, 2))
+    for i, city_locations in enumerate(truck_cities, 1):
+        input_values[f"truck_{i}"] = (rng.choice(city_locations), rng.choice(city_locations))
+    for i in range(1, rng.choice((0, 1, 1, 2)) + 1):
+        input_values[f"airplane_{i}"] = (rng.choice(airports), rng.choice(airports))
+    return input_values
+
+
+def random_instances(seed: int, count: int = INSTANCES) -> Iterator[Dict[str, Tuple[int, int]]]:
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield random_instance(rng)
+
+
+@pytest.fixture(scope="module")
+def native_solver() -> NativeLogisticSolver:
+    return NativeLogisticSolver(MAP)
+
+
+def test_native_plans_are_valid(native_solver):
+    simulator = get_simulator(MAP)
+    solved = 0
+    for input_values in random_instances(1):
+        plan = native_solver.solve(input_values)
+        if plan is None:
+            continue
+        solved += 1
+        result = simulator.simulate(input_values, plan)
+        assert result, (input_values, result.error)
+    # most of the random instances have a plan
+    assert solved > INSTANCES // 2
+
+
+def test_native_solver_rejects_unknown_locations(native_solver):
+    assert native_solver.solve({"package_1": (1, 99), "truck_1": (1, 1)}) is None
+
+
+def flat_problem(pb) -> Problem:
+    # the hierarchical problem without its task network, for the validator
+    problem = Problem(pb.name, pb.environment)
+    for fluent in pb.fluents:
+        problem.add_fluent(fluent)
+    problem.add_actions(pb.actions)
+    problem.add_objects(pb.all_objects)
+    for fluent_exp, value in pb.explicit_initial_values.items():
+        problem.set_initial_value(fluent_exp, value)
+    for goal in pb.goals:
+        problem.add_goal(goal)
+    return problem
+
+
+def drop_action(plan, rng):
+    plan = list(plan)
+    del plan[rng.randrange(len(plan))]
+    return plan
+
+
+def swap_actions(plan, rng):
+    plan = list(plan)
+    i, j = rng.randrange(len(plan)), rng.randrange(len(plan))
+    plan[i], plan[j] = plan[j], plan[i]
+    return plan
+
+
+def repeat_action(plan, rng):
+    plan = list(plan)
+    i = rng.randrange(len(plan))
+    return plan[:i + 1] + plan[i:]
+
+
+@pytest.mark.parametrize("change", [None, drop_action, swap_actions, repeat_action])
+def test_simulator_agrees_with_validator(native_solver, change):
+    get_environment().credits_stream = None
+    template = LogisticDomainTemplate(MAP)
+    simulator = get_simulator(MAP)
+    rng = random.Random(7)
+    invalid = 0
+    for input_values in random_instances(7, 60):
+        plan = native_solver.solve(input_values)
+        if not plan:
+            continue
+        if change is not None:
+            plan = change(plan, rng)
+        pb = template.instantiate(input_values)
+        problem = flat_problem(pb)
+        with PlanValidator(problem_kind=problem.kind, name="sequential_plan_validator") as validator:
+            status = validator.validate(problem, cached_to_plan(plan, pb)).status
+        result = simulator.simulate(input_values, plan)
+        assert bool(result) == (status == ValidationResultStatus.VALID), (input_values, plan, result.error)
+        invalid += not result
+    if change is None:
+        assert invalid == 0
+    else:
+        # the changes break some of the plans, not all of them
+        assert invalid > 0
+
+
+def test_optimized_plans_stay_valid(native_solver):
+    simulator = get_simulator(MAP)
+    for input_values in random_instances(2):
+        plan = native_solver.solve(input_values)
+        if plan is None:
+            continue
+        optimized = optimize_plan(plan)
+        assert len(optimized) <= len(plan)
+        result = simulator.simulate(input_values, optimized)
+        assert result, (input_values, plan, optimized, result.error)
+
+
+def test_optimizer_drops_round_trips(native_solver):
+    topology = get_topology(MAP)
+    input_values = {"package_1": (2, 9), "truck_1": (1, 3), "truck_2": (8, 8), "airplane_1": (1, 1)}
+    plan = native_solver.solve(input_values)
+    # truck_2 goes away and comes back without carrying anything
+    detour = [
+        ("move", ("truck_2", topology.location_name(8), topology.location_name(10))),
+        ("move", ("truck_2", topology.location_name(10), topology.location_name(8))),
+    ]
+    assert get_simulator(MAP).simulate(input_values, detour + plan)
+    optimized = optimize_plan(detour + plan)
+    assert len(optimized) <= len(plan)
+    assert get_simulator(MAP).simulate(input_values, optimized)
+
+
+def test_feasibility_matches_native_solver(native_solver):
+    infeasible = 0
+    for input_values in random_instances(3):
+        feasibility = check_feasibility(input_values, MAP)
+        infeasible += not feasibility
+        # the native solver finds a plan for every instance that has one
+        assert bool(feasibility) == (native_solver.solve(input_values) is not None), (input_values, feasibility)
+    assert 0 < infeasible < INSTANCES
+
+
+@pytest.mark.parametrize("input_values, reason", [
+    ({"package_1": (2, 3), "truck_1": (5, 5)}, "no_truck"),
+    ({"package_1": (1, 8), "truck_1": (1, 1), "truck_2": (8, 8)}, "no_airplane"),
+    ({"truck_1": (1, 5)}, "truck_other_city"),
+    ({"airplane_1": (1, 2)}, "airplane_not_airport"),
+    ({"package_1": (1, 99)}, "unknown_location"),
+])
+def test_feasibility_reasons(input_values, reason):
+    feasibility = check_feasibility(input_values, MAP)
+    assert not feasibility
+    assert reason in [r for r, _ in feasibility.reasons]
+
+
+def rename_objects(input_values: Dict[str, Tuple[int, int]], rng: random.Random) -> Dict[str, Tuple[int, int]]:
+    # the same instance, with the objects of every kind numbered in another order
+    names = list(input_values)
+    renamed = {}
+    for kind in ("package", "truck", "airplane"):
+        of_kind = [name for name in names if name.startswith(f"{kind}_")]
+        numbers = rng.sample(range(1, 3 * len(of_kind) + 1), len(of_kind))
+        for name, number in zip(of_kind, numbers):
+            renamed[f"{kind}_{number}"] = input_values[name]
+    items = list(renamed.items())
+    rng.shuffle(items)
+    return dict(items)
+
+
+def test_canonical_form_ignores_object_names():
+    rng = random.Random(4)
+    for input_values in random_instances(4):
+        canonical_values, _ = canonicalize(input_values, MAP)
+        assert canonicalize(rename_objects(input_values, rng), MAP)[0] == canonical_values
+
+
+def test_canonical_plans_map_back(native_solver):
+    simulator = get_simulator(MAP)
+    for input_values in random_instances(5):
+        canonical_values, renaming = canonicalize(input_values, MAP)
+        canonical_plan = native_solver.solve(canonical_values)
+        if canonical_plan is None:
+            assert native_solver.solve(input_values) is None
+            continue
+        # what the plan cache gives back for the stored canonical plan
+        plan = rename_cached(canonical_plan, invert_renaming(renaming))
+        result = simulator.simulate(input_values, plan)
+        assert result, (input_values, result.error)
+
+
+def test_wire_format_round_trips(native_solver):
+    assert decode_plan(encode_plan(None)) is None
+    for input_values in random_instances(6):
+        plan = native_solver.solve(input_values)
+        if plan is not None:
+            assert decode_plan(encode_plan(plan)) == plan
+
+
+@pytest.mark.parametrize("name", ["package_01", "package_", "truck_x", "boat_1"])
+def test_wire_format_rejects_other_names(name):
+    with pytest.raises(ValueError):
+        encode_plan([("load", (name, "truck_1", "location_2"))])
+
+
+def test_wire_format_rejects_truncated_data(native_solver):
+    plan = native_solver.solve({"package_1": (2, 9), "truck_1": (1, 3), "truck_2": (8, 8), "airplane_1": (1, 1)})
+    data = encode_plan(plan)
+    with pytest.raises(ValueError):
+        decode_plan(data[:-1])
@@ -0,0 +1,284 @@
+import os
+import random
+import sys
+import threading
+import time
+from fractions import Fraction
+from typing import Dict, List, Tuple
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+from bench_planning import StandInEngine, generate_instance
+from decomposition import ProblemDecomposer
+from domain_template import get_domain_template
+from engine_client import AsyncEngineClient, ClientEngine, EngineTimeout, SolveCancelled
+from logistic_map import LOCATIONS_MAP
+from modified_planning import convert_plan, planning
+from plan_cache import PlanCache, plan_to_cached
+from portfolio import PORTFOLIO_INVALID, Portfolio
+from replanning import PreviousSolve
+from scheduler import PlanningScheduler
+from validation import validate_cached
+
+import unified_planning as up
+from unified_planning.engines.results import PlanGenerationResult, PlanGenerationResultStatus
+from unified_planning.plans import PlanKind
+
+# Checks of the planning request path on the demo map: the plan cache, the
+# scheduler, the engine client, the portfolio, the decomposition, the repair
+# of edited instances and the conversion of the plans. The Graphene planner
+# is replaced by the stand-in engine of the benchmarks; every returned plan is
+# checked by the simulator of the domain.
+
+SOLVABLE = {
+    "package_1": (1, 4), "package_2": (2, 5), "package_3": (2, 6), "package_4": (8, 4), "package_5": (8, 5),
+    "truck_1": (1, 1), "truck_2": (4, 4), "truck_3": (7, 8),
+    "airplane_1": (1, 1), "airplane_2": (1, 4),
+}
+# the packages never leave their city: one group per city
+LOCAL = {
+    "package_1": (2, 3), "package_2": (3, 1), "package_3": (5, 6), "package_4": (6, 4), "package_5": (9, 10),
+    "truck_1": (1, 1), "truck_2": (4, 4), "truck_3": (7, 8), "airplane_1": (1, 1),
+}
+
+
+def assert_valid(input_values: Dict[str, Tuple[int, int]], plan: "up.plans.SequentialPlan"):
+    assert plan is not None
+    result = validate_cached(input_values, plan_to_cached(plan))
+    assert result, result.error
+
+
+class RecordingEngine(StandInEngine):
+    # the stand-in engine, keeping the names of the objects of every problem solved
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.solved: List[List[str]] = []
+
+    def solve(self, pb):
+        self.solved.append(sorted(o.name for o in pb.all_objects if o.type.name in ("Package", "Truck", "Airplane")))
+        return super().solve(pb)
+
+
+class FixedEngine:
+    # always gives the same result, or raises the same error
+    def __init__(self, status=PlanGenerationResultStatus.UNSOLVABLE_PROVEN, plan=None, error=None, latency: float = 0.0):
+        self.status, self.plan, self.error, self.latency = status, plan, error, latency
+        self.calls = 0
+
+    def solve(self, pb):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        return PlanGenerationResult(self.status, self.plan, "fixed")
+
+
+class HungEngine:
+    # never answers until destroyed, as a planner that doesn't answer
+    def __init__(self):
+        self.destroyed = threading.Event()
+
+    def solve(self, pb):
+        self.destroyed.wait(10)
+        return PlanGenerationResult(PlanGenerationResultStatus.TIMEOUT, None, "hung")
+
+    def destroy(self):
+        self.destroyed.set()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def quiet_credits():
+    up.shortcuts.get_environment().credits_stream = None
+
+
+def test_cache_serves_renamed_instances():
+    cache = PlanCache()
+    engine = RecordingEngine()
+    assert_valid(SOLVABLE, planning(engine, SOLVABLE, plan_cache=cache))
+    # the same instance with the packages numbered in another order
+    renamed = {f"package_{6 - int(name[-1])}" if name.startswith("package_") else name: values for name, values in SOLVABLE.items()}
+    assert_valid(renamed, planning(engine, renamed, plan_cache=cache))
+    assert len(engine.solved) == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("status, cached", [
+    (PlanGenerationResultStatus.UNSOLVABLE_PROVEN, True),
+    (PlanGenerationResultStatus.UNSOLVABLE_INCOMPLETELY, False),
+    (PlanGenerationResultStatus.UNSUPPORTED_PROBLEM, False),
+])
+def test_cache_keeps_only_proven_negatives(status, cached):
+    cache = PlanCache()
+    engine = FixedEngine(status)
+    assert planning(engine, SOLVABLE, plan_cache=cache) is None
+    assert planning(engine, SOLVABLE, plan_cache=cache) is None
+    assert engine.calls == (1 if cached else 2)
+
+
+def test_cache_on_disk(tmp_path):
+    pb = get_domain_template().instantiate(SOLVABLE)
+    plan = convert_plan(StandInEngine().solve(pb).plan, pb)
+    PlanCache(persistent_dir=str(tmp_path)).put(SOLVABLE, plan)
+    # e.g. after a restart
+    found, cached_plan = PlanCache(persistent_dir=str(tmp_path)).get(SOLVABLE, pb)
+    assert found
+    assert plan_to_cached(cached_plan) == plan_to_cached(plan)
+    # a plan that can't be written is kept in memory
+    cache = PlanCache(persistent_dir=str(tmp_path / "dir"))
+    os.rmdir(tmp_path / "dir")
+    (tmp_path / "dir").write_text("not a directory")
+    cache.put(SOLVABLE, plan)
+    assert cache.get(SOLVABLE, pb)[0]
+
+
+def test_scheduler_solves_concurrent_jobs():
+    scheduler = PlanningScheduler(lambda: StandInEngine(latency=0.05), workers=3, max_queue_depth=32)
+    scheduler.start()
+    rng = random.Random(1)
+    instances = [generate_instance(LOCATIONS_MAP, 5, 3, 1, rng) for _ in range(12)]
+    try:
+        start = time.perf_counter()
+        jobs = [scheduler.submit(input_values, block=True) for input_values in instances]
+        assert all(job.wait(10) for job in jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        scheduler.stop()
+    for input_values, job in zip(instances, jobs):
+        assert job.error is None
+        assert_valid(input_values, job.plan)
+    # 12 solves of 0.05s by 3 workers
+    assert elapsed < 12 * 0.05
+
+
+def test_scheduler_reports_engine_failures():
+    def factory():
+        raise RuntimeError("no planner")
+
+    scheduler = PlanningScheduler(factory, workers=1)
+    scheduler.start()
+    try:
+        jobs = [scheduler.submit(SOLVABLE) for _ in range(2)]
+        assert all(job.wait(10) for job in jobs)
+    finally:
+        scheduler.stop()
+    assert all(isinstance(job.error, RuntimeError) for job in jobs)
+
+
+def test_engine_client_solves():
+    client = AsyncEngineClient(StandInEngine, max_concurrent=2)
+    client.start()
+    try:
+        assert_valid(SOLVABLE, planning(ClientEngine(client), SOLVABLE))
+    finally:
+        client.stop()
+
+
+def test_engine_client_bounds_hung_engines():
+    engines: List[HungEngine] = []
+
+    def factory():
+        engines.append(HungEngine())
+        return engines[-1]
+
+    client = AsyncEngineClient(factory, max_concurrent=2, timeout=0.05, retries=1, retry_backoff=0.01)
+    client.start()
+    pb = get_domain_template().instantiate(SOLVABLE)
+    try:
+        with pytest.raises(EngineTimeout):
+            ClientEngine(client).solve(pb)
+        # the timed out engines are destroyed, and can't be solving anymore
+        assert engines and all(engine.destroyed.wait(1) for engine in engines)
+    finally:
+        client.stop()
+
+
+def test_engine_client_cancel():
+    client = AsyncEngineClient(HungEngine, max_concurrent=1)
+    client.start()
+    engine = ClientEngine(client)
+    pb = get_domain_template().instantiate(SOLVABLE)
+    try:
+        timer = threading.Timer(0.1, engine.cancel)
+        timer.start()
+        start = time.perf_counter()
+        with pytest.raises(SolveCancelled):
+            engine.solve(pb)
+        assert time.perf_counter() - start < 5
+        with pytest.raises(SolveCancelled):
+            engine.solve(pb)
+    finally:
+        client.stop()
+
+
+def test_portfolio_returns_a_valid_plan():
+    # a plan of another instance is not valid for this one
+    other = get_domain_template().instantiate(LOCAL)
+    invalid_plan = StandInEngine().solve(other).plan
+    invalid_before = PORTFOLIO_INVALID.value("invalid")
+    portfolio = Portfolio([
+        ("failing", AsyncEngineClient(lambda: FixedEngine(error=RuntimeError("crashed")))),
+        ("invalid", AsyncEngineClient(lambda: FixedEngine(PlanGenerationResultStatus.SOLVED_SATISFICING, invalid_plan))),
+        ("stand-in", AsyncEngineClient(lambda: StandInEngine(latency=0.1))),
+    ])
+    portfolio.start()
+    try:
+        assert_valid(SOLVABLE, planning(ClientEngine(portfolio), SOLVABLE))
+    finally:
+        portfolio.stop()
+    assert PORTFOLIO_INVALID.value("invalid") == invalid_before + 1
+
+
+def test_portfolio_prefers_errors_to_incomplete_negatives():
+    portfolio = Portfolio([
+        ("incomplete", AsyncEngineClient(lambda: FixedEngine(PlanGenerationResultStatus.UNSOLVABLE_INCOMPLETELY))),
+        ("failing", AsyncEngineClient(lambda: FixedEngine(error=RuntimeError("crashed"), latency=0.05))),
+    ])
+    portfolio.start()
+    pb = get_domain_template().instantiate(SOLVABLE)
+    try:
+        with pytest.raises(RuntimeError):
+            ClientEngine(portfolio).solve(pb)
+    finally:
+        portfolio.stop()
+
+
+def test_decomposer_merges_the_groups():
+    engine = RecordingEngine()
+    decomposer = ProblemDecomposer(lambda: engine, workers=2, min_packages=2)
+    assert len(decomposer.partition(LOCAL)) == 3
+    decomposer.start()
+    try:
+        pb = get_domain_template().instantiate(LOCAL)
+        assert_valid(LOCAL, decomposer.solve(LOCAL, pb))
+    finally:
+        decomposer.stop()
+    # every group is solved alone
+    assert len(engine.solved) == 3
+    assert all(len(objects) < len(LOCAL) for objects in engine.solved)
+
+
+def test_repair_solves_only_the_changed_objects():
+    engine = RecordingEngine()
+    plan = planning(engine, LOCAL)
+    assert_valid(LOCAL, plan)
+    edited = dict(LOCAL, package_5=(10, 9))
+    repaired = planning(engine, edited, previous=PreviousSolve(LOCAL, plan_to_cached(plan)))
+    assert_valid(edited, repaired)
+    # the packages of the other cities, and their trucks, are kept
+    assert "package_5" in engine.solved[-1] and "package_1" not in engine.solved[-1]
+
+
+def test_convert_plan_by_kind():
+    pb = get_domain_template().instantiate(SOLVABLE)
+    plan = StandInEngine().solve(pb).plan
+    assert plan.kind == PlanKind.SEQUENTIAL_PLAN
+    assert convert_plan(plan, pb) is plan
+    assert convert_plan(None, pb) is None
+    # the actions are ordered by their start, whatever the order of the list
+    timed_actions = [(Fraction(i), action, None) for i, action in enumerate(plan.actions)]
+    random.Random(2).shuffle(timed_actions)
+    time_triggered = up.plans.TimeTriggeredPlan(timed_actions, pb.environment)
+    assert plan_to_cached(convert_plan(time_triggered, pb)) == plan_to_cached(plan)